@@ -0,0 +1,58 @@
+# Global admission control for expensive work: retrieval, LLM generation and bulk ingestion.
+# At most MAX_ACTIVE_QUERIES run at once; up to MAX_QUEUED_QUERIES more wait for a slot.
+# Anything beyond that is rejected immediately, so overload turns into fast 429s instead of piling up timeouts.
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+MAX_ACTIVE_QUERIES = int(os.getenv("MAX_ACTIVE_QUERIES", "32"))
+MAX_QUEUED_QUERIES = int(os.getenv("MAX_QUEUED_QUERIES", "64"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "10"))
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionController:
+    def __init__(self, max_active: int = MAX_ACTIVE_QUERIES, max_queued: int = MAX_QUEUED_QUERIES, queue_timeout: float = QUEUE_TIMEOUT_SECONDS):
+        self.slots = asyncio.Semaphore(max_active)
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+
+    async def acquire(self):
+        # Takes a slot, waiting in the bounded queue if needed. Raises Overloaded when the queue is full or the wait times out.
+        if not self.slots.locked():
+            await self.slots.acquire()
+            return
+
+        if self.waiting >= self.max_queued:
+            raise Overloaded("Too many queries in flight.")
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded("Timed out waiting for a free query slot.")
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self.slots.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        # `async with admission.slot():` around a unit of work that doesn't outlive the caller.
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {"waiting": self.waiting, "available_slots": self.slots._value}
+
+
+admission = AdmissionController()
@@ -0,0 +1,58 @@
+# Request body limits for the upload endpoints, enforced before FastAPI parses (and spools) the multipart form.
+# A declared Content-Length over the limit is rejected straight away; chunked or understated bodies are
+# counted as they stream in, and the request is answered with 413 as soon as the limit is crossed.
+
+import json
+from typing import Dict
+
+
+class BodySizeLimitMiddleware:
+    # Plain ASGI middleware; `limits` maps a path to its maximum request body size in bytes.
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps({"detail": f"Request body too large. The limit is {limit // (1024 * 1024)} MB."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            await self._reject(send, limit)
+            return
+
+        state = {"received": 0, "rejected": False}
+
+        async def limited_receive():
+            if state["rejected"]:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > limit:
+                    # Answer now, then make the app see a disconnect so it stops reading the body
+                    state["rejected"] = True
+                    await self._reject(send, limit)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            # Whatever the app answers after the 413 has been sent is dropped
+            if not state["rejected"]:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
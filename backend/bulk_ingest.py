@@ -0,0 +1,207 @@
+# Bulk ingestion pipeline used by POST /api/ingest/bulk and as a command-line tool over a directory.
+# Files flow through three stages connected by bounded queues:
+#   parse + chunk (thread pool) -> embed (cross-file batches) -> save (one transaction per file)
+# so parsing the next file, embedding and committing all overlap, and throughput approaches the slowest stage.
+
+import argparse
+import os
+import queue
+import re
+import threading
+from typing import List, Optional, Tuple
+
+from ml.parser import parse_file
+from ml.chunker import recursive_chunker
+from ml.embedder import generate_embeddings
+from db import save_ingestion_data
+
+SUPPORTED_EXTENSIONS = ['pdf', 'txt', 'md']
+
+PARSE_WORKERS = int(os.getenv("BULK_PARSE_WORKERS", "4"))
+SAVE_WORKERS = int(os.getenv("BULK_SAVE_WORKERS", "2"))
+EMBED_BATCH_SIZE = int(os.getenv("BULK_EMBED_BATCH_SIZE", "64"))  # Chunks per embedding request, across files
+QUEUE_SIZE = int(os.getenv("BULK_QUEUE_SIZE", "8"))                # Files buffered between stages
+
+_DONE = object()
+
+
+class FileJob:
+    def __init__(self, filename: str, path: str):
+        self.filename = filename
+        self.path = path
+        self.ext = filename.split('.')[-1].lower()
+        self.content = ""
+        self.chunks: List[str] = []
+        self.embeddings: List[Optional[List[float]]] = []
+        self.pending = 0
+        self.error: Optional[str] = None
+        self.document_id: Optional[str] = None
+
+    def result(self) -> dict:
+        if self.error:
+            return {"filename": self.filename, "status": "failed", "error": self.error}
+        return {
+            "filename": self.filename,
+            "status": "ingested",
+            "document_id": self.document_id,
+            "chunks_created": len(self.chunks)
+        }
+
+
+def _parse_stage(inbox: queue.Queue, outbox: queue.Queue):
+    while True:
+        job = inbox.get()
+        if job is _DONE:
+            outbox.put(_DONE)
+            return
+        try:
+            if job.ext not in SUPPORTED_EXTENSIONS:
+                raise ValueError("Unsupported file type. Only PDF, TXT, and MD are allowed.")
+
+            raw_text = parse_file(job.path)
+            job.content = re.sub(r'\s+', ' ', raw_text).strip()
+            if not job.content:
+                raise ValueError("Could not extract any text from the file.")
+
+            job.chunks = recursive_chunker(job.content, chunk_size=800, overlap=200)
+            if not job.chunks:
+                raise ValueError("File text is too short to process.")
+
+            job.embeddings = [None] * len(job.chunks)
+            job.pending = len(job.chunks)
+        except Exception as e:
+            job.error = str(e)
+        outbox.put(job)
+
+
+def _embed_stage(inbox: queue.Queue, outbox: queue.Queue, parse_workers: int, save_workers: int):
+    batch: List[Tuple[FileJob, int]] = []  # (job, chunk position)
+    finished_parsers = 0
+
+    def flush():
+        if not batch:
+            return
+        jobs = {id(job): job for job, _ in batch}
+        try:
+            vectors = generate_embeddings([job.chunks[i] for job, i in batch])
+            if len(vectors) != len(batch):
+                raise ValueError("Embedding API returned the wrong number of vectors")
+            for (job, i), vector in zip(batch, vectors):
+                job.embeddings[i] = vector
+                job.pending -= 1
+        except Exception as e:
+            for job in jobs.values():
+                job.error = job.error or f"AI Service Error: {e}"
+        batch.clear()
+
+        for job in jobs.values():
+            if not job.error and job.pending == 0:
+                outbox.put(job)
+
+    while finished_parsers < parse_workers:
+        try:
+            # Don't hold a partial batch hostage while upstream is still parsing
+            job = inbox.get(timeout=0.2 if batch else None)
+        except queue.Empty:
+            flush()
+            continue
+
+        if job is _DONE:
+            finished_parsers += 1
+            continue
+        if job.error:
+            continue
+
+        for i in range(len(job.chunks)):
+            batch.append((job, i))
+            if len(batch) >= EMBED_BATCH_SIZE:
+                flush()
+
+    flush()
+    for _ in range(save_workers):
+        outbox.put(_DONE)
+
+
+def _save_stage(inbox: queue.Queue, user_id: str):
+    while True:
+        job = inbox.get()
+        if job is _DONE:
+            return
+        try:
+            job.document_id = save_ingestion_data(
+                user_id=user_id,
+                filename=job.filename,
+                file_type=job.ext,
+                content=job.content,
+                chunks=job.chunks,
+                embeddings=job.embeddings
+            )
+        except Exception as e:
+            job.error = f"Database Transaction Failed: {e}"
+
+
+def run_bulk_ingestion(
+    user_id: str,
+    files: List[Tuple[str, str]],
+    parse_workers: int = PARSE_WORKERS,
+    save_workers: int = SAVE_WORKERS
+) -> List[dict]:
+    # Ingests [(filename, path)] for a user and returns one result dict per file, in input order.
+    jobs = [FileJob(filename, path) for filename, path in files]
+    if not jobs:
+        return []
+
+    parse_queue: queue.Queue = queue.Queue()
+    embed_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+    save_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    for job in jobs:
+        parse_queue.put(job)
+    for _ in range(parse_workers):
+        parse_queue.put(_DONE)
+
+    threads = [threading.Thread(target=_parse_stage, args=(parse_queue, embed_queue)) for _ in range(parse_workers)]
+    threads.append(threading.Thread(target=_embed_stage, args=(embed_queue, save_queue, parse_workers, save_workers)))
+    threads += [threading.Thread(target=_save_stage, args=(save_queue, user_id)) for _ in range(save_workers)]
+
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return [job.result() for job in jobs]
+
+
+def collect_directory(directory: str) -> List[Tuple[str, str]]:
+    # Walks a directory and returns [(filename, path)] for every supported file.
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if name.split('.')[-1].lower() in SUPPORTED_EXTENSIONS:
+                files.append((name, os.path.join(root, name)))
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-ingest every PDF, TXT and MD file in a directory.")
+    parser.add_argument("directory")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS)
+    parser.add_argument("--save-workers", type=int, default=SAVE_WORKERS)
+    args = parser.parse_args()
+
+    results = run_bulk_ingestion(
+        args.user_id,
+        collect_directory(args.directory),
+        parse_workers=args.parse_workers,
+        save_workers=args.save_workers
+    )
+
+    for r in results:
+        if r["status"] == "ingested":
+            print(f"OK    {r['filename']} ({r['chunks_created']} chunks) -> {r['document_id']}")
+        else:
+            print(f"FAIL  {r['filename']}: {r['error']}")
+
+    failed_count = sum(1 for r in results if r["status"] != "ingested")
+    print(f"{len(results) - failed_count} ingested, {failed_count} failed")
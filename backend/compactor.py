@@ -0,0 +1,94 @@
+# Background compaction for soft-deleted documents.
+# Removes chunks and documents in bounded batches so no single statement holds locks for long,
+# then vacuums the chunks table on a slower schedule and reindexes it once enough rows were purged
+# to leave real HNSW/GIN bloat. Every worker and replica starts a compactor, but only the one holding
+# the compaction advisory lock does any work; another takes over if that process goes away.
+
+import asyncio
+import os
+import time
+
+from db import purge_deleted_chunks, purge_deleted_documents, run_maintenance, acquire_advisory_lock, estimate_chunk_count
+
+COMPACT_INTERVAL_SECONDS = int(os.getenv("COMPACT_INTERVAL_SECONDS", "60"))
+COMPACT_BATCH_SIZE = int(os.getenv("COMPACT_BATCH_SIZE", "1000"))
+COMPACT_MAX_BATCHES = int(os.getenv("COMPACT_MAX_BATCHES", "50"))  # Per tick, so a huge backlog can't monopolise the DB
+VACUUM_INTERVAL_SECONDS = int(os.getenv("VACUUM_INTERVAL_SECONDS", "3600"))
+REINDEX_INTERVAL_SECONDS = int(os.getenv("REINDEX_INTERVAL_SECONDS", "86400"))
+REINDEX_MIN_PURGED_FRACTION = float(os.getenv("REINDEX_MIN_PURGED_FRACTION", "0.2"))  # Purged rows vs. live chunks
+
+COMPACTOR_LOCK_KEY = 0x68726167  # pg_try_advisory_lock key shared by every process running the compactor
+
+
+class Compactor:
+    def __init__(self):
+        self.lock_conn = None  # Open while this process is the one running compaction
+        self.rows_since_vacuum = 0
+        self.rows_since_reindex = 0
+        self.last_vacuum = time.monotonic()
+        self.last_reindex = time.monotonic()
+
+    def _is_runner(self) -> bool:
+        # Holds on to the advisory lock, or tries to take it over if the previous runner is gone.
+        if self.lock_conn is not None:
+            try:
+                self.lock_conn.execute("SELECT 1;")
+                return True
+            except Exception:
+                self.lock_conn.close()
+                self.lock_conn = None
+
+        self.lock_conn = acquire_advisory_lock(COMPACTOR_LOCK_KEY)
+        if self.lock_conn is not None:
+            # Purge counts from before we became the runner are unknown, so schedules start over
+            self.rows_since_vacuum = self.rows_since_reindex = 0
+            self.last_vacuum = self.last_reindex = time.monotonic()
+        return self.lock_conn is not None
+
+    def compact_once(self) -> int:
+        # Runs one compaction tick and returns how many chunk rows were removed.
+        if not self._is_runner():
+            return 0
+
+        removed = 0
+        for _ in range(COMPACT_MAX_BATCHES):
+            batch = purge_deleted_chunks(COMPACT_BATCH_SIZE)
+            removed += batch
+            if batch < COMPACT_BATCH_SIZE:
+                break
+
+        # Documents go once all of their chunks are gone
+        for _ in range(COMPACT_MAX_BATCHES):
+            if purge_deleted_documents(COMPACT_BATCH_SIZE) < COMPACT_BATCH_SIZE:
+                break
+
+        self.rows_since_vacuum += removed
+        self.rows_since_reindex += removed
+        now = time.monotonic()
+
+        if self.rows_since_vacuum and now - self.last_vacuum >= VACUUM_INTERVAL_SECONDS:
+            run_maintenance("VACUUM (ANALYZE) chunks")
+            self.rows_since_vacuum = 0
+            self.last_vacuum = now
+
+        # Rebuilding the HNSW index is expensive, so only do it when a meaningful share of it is dead entries
+        if now - self.last_reindex >= REINDEX_INTERVAL_SECONDS:
+            if self.rows_since_reindex >= REINDEX_MIN_PURGED_FRACTION * max(estimate_chunk_count(), 1):
+                run_maintenance("REINDEX TABLE CONCURRENTLY chunks")
+                self.rows_since_reindex = 0
+            self.last_reindex = now
+
+        return removed
+
+    async def run_forever(self):
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.compact_once)
+                if removed:
+                    print(f"Compactor removed {removed} chunks of deleted documents")
+            except Exception as e:
+                print(f"Compaction failed: {e}")
+            await asyncio.sleep(COMPACT_INTERVAL_SECONDS)
+
+
+compactor = Compactor()
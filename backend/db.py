@@ -1,11 +1,16 @@
 import psycopg
+import threading
+from psycopg_pool import ConnectionPool
 from pgvector.psycopg import register_vector
 from typing import List
 from dotenv import load_dotenv
 import os
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional
 import json
 
+from ml.bm25_index import bm25_index
+from ml.chunker import chunk_hash, diff_chunks, chunk_offsets
+
 load_dotenv()
 
 DB_PARAMS = {
@@ -16,11 +21,58 @@ DB_PARAMS = {
     "password": os.getenv("DB_PASSWORD")
 }
 
+# When enabled, chunks are stored as (start_offset, end_offset) into documents.content instead of a copy of their text
+# (see migrations/003_compact_chunks.sql). Rows stored either way are read through CHUNK_CONTENT_SQL.
+COMPACT_STORAGE = os.getenv("COMPACT_STORAGE", "true").lower() == "true"
+
+# Materializes a chunk's text from its own content column or from its span of the parent document.
+# substr() decompresses the body up to the span for every row, so this is only meant for top-k results;
+# bulk readers slice bodies in Python instead (see _iter_document_bodies).
+CHUNK_CONTENT_SQL = "COALESCE(c.content, substr(d.content, c.start_offset + 1, c.end_offset - c.start_offset))"
+
+# Keyword search vector: offset-stored chunks carry a stripped content_tsv, the rest are parsed from their own text
+# (both indexed, see migrations/003_compact_chunks.sql). Stripped on both sides so their ts_rank scores compare.
+KEYWORD_TSV_SQL = "COALESCE(c.content_tsv, strip(to_tsvector('english', c.content)))"
+
+
+def keyword_match_sql(query: str) -> str:
+    # Match condition written so each branch can use its partial GIN index.
+    return f"(c.content_tsv @@ {query} OR (c.content IS NOT NULL AND to_tsvector('english', c.content) @@ {query}))"
+
+
+# When enabled, delete_document only flags rows (see migrations/001_soft_delete.sql) and compactor.py removes them later
+SOFT_DELETE = os.getenv("SOFT_DELETE", "true").lower() == "true"
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    # Lazily opens the shared connection pool. Every pooled connection has the vector type registered.
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    conninfo="",
+                    kwargs=DB_PARAMS,
+                    configure=register_vector,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    open=True
+                )
+    return _pool
+
+def warm_pool(timeout: float = 30.0):
+    # Blocks until the pool has opened its minimum number of connections (used by the startup warm-up).
+    get_pool().wait(timeout=timeout)
+
 def get_connection():
-    # Creates a new database connection and registers the vector type.
-    conn = psycopg.connect(**DB_PARAMS)
-    register_vector(conn)
-    return conn
+    # Borrows a connection from the pool. Used as `with get_connection() as conn:`, which commits on success,
+    # rolls back on error and returns the connection to the pool.
+    return get_pool().connection()
 
 def save_ingestion_data(
     user_id: str, 
@@ -28,7 +80,8 @@ def save_ingestion_data(
     file_type: str, 
     content: str, 
     chunks: List[str], 
-    embeddings: List[List[float]]
+    embeddings: List[List[float]],
+    document_key: Optional[str] = None
 ) -> str:
     # Performs a single transaction to save the document and all its chunks.
     with get_connection() as conn:
@@ -37,34 +90,248 @@ def save_ingestion_data(
                 # Insert the parent Document and grab its new UUID
                 cur.execute(
                     """
-                    INSERT INTO documents (user_id, filename, file_type, content, file_size_bytes)
-                    VALUES (%s, %s, %s, %s, %s)
+                    INSERT INTO documents (user_id, filename, file_type, content, file_size_bytes, document_key)
+                    VALUES (%s, %s, %s, %s, %s, %s)
                     RETURNING id;
                     """,
-                    (user_id, filename, file_type, content, len(content.encode('utf-8')))
+                    (user_id, filename, file_type, content, len(content.encode('utf-8')), document_key)
                 )
                 
                 document_id = cur.fetchone()[0]
                 
                 # Insert every Chunk linked to that Document UUID
+                offsets = chunk_offsets(content, chunks)
+                chunk_ids = []
                 for i, (chunk_text, embedding) in enumerate(zip(chunks, embeddings)):
+                    chunk_ids.append(_insert_chunk(cur, document_id, i, chunk_text, embedding, offsets[i]))
+
+                _refresh_centroid(cur, document_id)
+                generation = _bump_index_generation(cur, user_id)
+                
+                # Only save to the database if ALL insertions worked
+                conn.commit()
+            
+            except Exception as e:
+                # If anything fails, undo the whole operation
+                conn.rollback()
+                raise RuntimeError(f"Database transaction failed: {e}")
+
+    # Keep the in-memory BM25 index in sync with the committed rows
+    bm25_index.add_chunks(user_id, generation, str(document_id), zip(chunk_ids, chunks))
+    return str(document_id)
+
+
+def _bump_index_generation(cur, user_id: str) -> int:
+    # Marks the user's live chunks as changed so every process's BM25 index picks up this write.
+    # Called last in the transaction, because the row lock serializes concurrent writers for this user.
+    cur.execute(
+        """
+        INSERT INTO search_index_generations (user_id, generation) VALUES (%s, 1)
+        ON CONFLICT (user_id) DO UPDATE SET generation = search_index_generations.generation + 1
+        RETURNING generation;
+        """,
+        (user_id,)
+    )
+    return cur.fetchone()[0]
+
+
+def get_index_generation(user_id: str) -> int:
+    # Current search index generation for a user (0 if they never wrote anything).
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT generation FROM search_index_generations WHERE user_id = %s;", (user_id,))
+            row = cur.fetchone()
+            return row[0] if row else 0
+
+
+def _insert_chunk(cur, document_id, chunk_index: int, chunk_text: str, embedding: List[float], offset: Optional[tuple]) -> str:
+    # Inserts one chunk. In compact mode a chunk found in the document body only stores its offsets plus a
+    # stripped tsvector for keyword search; chunks that keep their text are matched on it directly (see KEYWORD_TSV_SQL).
+    if COMPACT_STORAGE and offset is not None:
+        content, start, end, tsv_text = None, offset[0], offset[1], chunk_text
+    else:
+        content, start, end, tsv_text = chunk_text, -1, None, None
+
+    cur.execute(
+        """
+        INSERT INTO chunks (document_id, chunk_index, content, start_offset, end_offset, content_tsv, embedding, content_hash)
+        VALUES (%s, %s, %s, %s, %s, strip(to_tsvector('english', %s)), %s, %s)
+        RETURNING id;
+        """,
+        (document_id, chunk_index, content, start, end, tsv_text, embedding, chunk_hash(chunk_text))
+    )
+    return str(cur.fetchone()[0])
+
+
+def _refresh_centroid(cur, document_id):
+    # Stores the mean of the document's chunk embeddings, used to route queries to documents.
+    cur.execute(
+        """
+        UPDATE documents
+        SET centroid = (SELECT avg(embedding) FROM chunks WHERE document_id = %s)
+        WHERE id = %s;
+        """,
+        (document_id, document_id)
+    )
+
+
+def find_document_chunks(user_id: str, filename: str, document_key: Optional[str] = None) -> Optional[dict]:
+    # Looks up the live document a re-upload should replace (by document_key if given, otherwise by filename)
+    # and returns its id plus a map of content_hash -> [chunk_id] for its stored chunks.
+    # A key that matches nothing falls back to a keyless document with the same filename, so the first keyed
+    # re-upload of a document that was originally uploaded without a key updates it instead of duplicating it.
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            row = None
+            if document_key:
+                cur.execute(
+                    """
+                    SELECT id FROM documents
+                    WHERE user_id = %s AND document_key = %s AND deleted_at IS NULL
+                    ORDER BY uploaded_at DESC LIMIT 1;
+                    """,
+                    (user_id, document_key)
+                )
+                row = cur.fetchone()
+            if row is None:
+                key_filter = " AND document_key IS NULL" if document_key else ""
+                cur.execute(
+                    f"""
+                    SELECT id FROM documents
+                    WHERE user_id = %s AND filename = %s AND deleted_at IS NULL{key_filter}
+                    ORDER BY uploaded_at DESC LIMIT 1;
+                    """,
+                    (user_id, filename)
+                )
+                row = cur.fetchone()
+            if row is None:
+                return None
+
+            document_id = row[0]
+            return {"document_id": str(document_id), "chunk_hashes": _read_chunk_hashes(cur, document_id)}
+
+
+def _read_chunk_hashes(cur, document_id) -> Dict[str, List[str]]:
+    # Map of content_hash -> [chunk_id] for a document's stored chunks, in chunk order.
+    cur.execute(
+        "SELECT id, content_hash FROM chunks WHERE document_id = %s ORDER BY chunk_index;",
+        (document_id,)
+    )
+    hashes: Dict[str, List[str]] = {}
+    for chunk_id, content_hash in cur.fetchall():
+        hashes.setdefault(content_hash, []).append(str(chunk_id))
+    return hashes
+
+
+class DocumentChanged(Exception):
+    # The stored chunks changed between planning a re-upload diff and applying it; plan again.
+    pass
+
+
+def replace_ingestion_data(
+    user_id: str,
+    document_id: str,
+    filename: str,
+    content: str,
+    chunks: List[str],
+    new_embeddings: Dict[int, List[float]],
+    document_key: Optional[str] = None
+) -> dict:
+    # Applies a chunk-level diff to an existing document in a single transaction.
+    # `new_embeddings` maps chunk position -> embedding for chunks whose hash was not already stored;
+    # every other position reuses a stored chunk row and only has its chunk_index renumbered.
+    # The diff is recomputed under a row lock on the document, so concurrent re-uploads of the same document
+    # apply one after the other. Raises DocumentChanged if the stored chunks moved on since the caller
+    # embedded, i.e. a position now needs an embedding that wasn't supplied.
+    offsets = chunk_offsets(content, chunks)
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(
+                    "SELECT id FROM documents WHERE id = %s AND user_id = %s AND deleted_at IS NULL FOR UPDATE;",
+                    (document_id, user_id)
+                )
+                if cur.fetchone() is None:
+                    raise ValueError("Document no longer exists.")
+
+                reused, to_embed, vanished = diff_chunks(chunks, _read_chunk_hashes(cur, document_id))
+                if any(i not in new_embeddings for i in to_embed):
+                    raise DocumentChanged("Document was modified by a concurrent upload.")
+
+                cur.execute(
+                    """
+                    UPDATE documents
+                    SET filename = %s, content = %s, file_size_bytes = %s, uploaded_at = now(),
+                        document_key = COALESCE(%s, document_key)
+                    WHERE id = %s AND user_id = %s AND deleted_at IS NULL
+                    RETURNING id;
+                    """,
+                    (filename, content, len(content.encode('utf-8')), document_key, document_id, user_id)
+                )
+                if cur.fetchone() is None:
+                    raise ValueError("Document no longer exists.")
+
+                if vanished:
+                    cur.execute("DELETE FROM chunks WHERE id = ANY(%s::uuid[]);", (vanished,))
+
+                # Renumber in two passes (park on negative indexes first) so swaps never collide
+                if reused:
+                    ids = [chunk_id for chunk_id, _ in reused]
+                    positions = [i for _, i in reused]
+                    cur.execute(
+                        "UPDATE chunks SET chunk_index = -1 - chunk_index WHERE id = ANY(%s::uuid[]);",
+                        (ids,)
+                    )
+                    if cur.rowcount != len(ids):
+                        raise DocumentChanged("Reused chunks disappeared during the update.")
                     cur.execute(
                         """
-                        INSERT INTO chunks (document_id, chunk_index, content, embedding)
-                        VALUES (%s, %s, %s, %s);
+                        UPDATE chunks c SET chunk_index = v.idx
+                        FROM unnest(%s::uuid[], %s::int[]) AS v(id, idx)
+                        WHERE c.id = v.id;
                         """,
-                        (document_id, i, chunk_text, embedding)
+                        (ids, positions)
                     )
-                
-                # Only save to the database if ALL insertions worked
+
+                    # Offset-stored chunks point into the old body, so re-point them at the new one
+                    moved = [(chunk_id, offsets[i]) for chunk_id, i in reused if offsets[i] is not None]
+                    if moved:
+                        cur.execute(
+                            """
+                            UPDATE chunks c SET start_offset = v.s, end_offset = v.e
+                            FROM unnest(%s::uuid[], %s::int[], %s::int[]) AS v(id, s, e)
+                            WHERE c.id = v.id AND c.content IS NULL;
+                            """,
+                            ([m[0] for m in moved], [m[1][0] for m in moved], [m[1][1] for m in moved])
+                        )
+
+                inserted_ids = []
+                for i in to_embed:
+                    chunk_id = _insert_chunk(cur, document_id, i, chunks[i], new_embeddings[i], offsets[i])
+                    inserted_ids.append((chunk_id, chunks[i]))
+
+                _refresh_centroid(cur, document_id)
+                generation = _bump_index_generation(cur, user_id)
+
                 conn.commit()
-                return str(document_id)
-                
+
+            except DocumentChanged:
+                conn.rollback()
+                raise
             except Exception as e:
-                # If anything fails, undo the whole operation
                 conn.rollback()
                 raise RuntimeError(f"Database transaction failed: {e}")
-            
+
+    bm25_index.replace_chunks(user_id, generation, document_id, vanished, inserted_ids)
+
+    return {
+        "document_id": document_id,
+        "chunks_reused": len(reused),
+        "chunks_inserted": len(to_embed),
+        "chunks_deleted": len(vanished)
+    }
+
 
 def get_all_documents(user_id: str) -> List[dict]:
     # Fetches all documents uploaded by a specific user.
@@ -75,6 +342,7 @@ def get_all_documents(user_id: str) -> List[dict]:
                 SELECT id, filename, file_type, file_size_bytes, uploaded_at 
                 FROM documents 
                 WHERE user_id = %s 
+                  AND deleted_at IS NULL
                 ORDER BY uploaded_at DESC;
                 """,
                 (user_id,)
@@ -97,47 +365,202 @@ def delete_document(document_id: str, user_id: str) -> bool:
     with get_connection() as conn:
         with conn.cursor() as cur:
             # Enforce user_id so users can't delete other people's files
+            if SOFT_DELETE:
+                # Only flag the document; the compactor removes it and its chunks in the background
+                cur.execute(
+                    """
+                    UPDATE documents 
+                    SET deleted_at = now() 
+                    WHERE id = %s AND user_id = %s AND deleted_at IS NULL 
+                    RETURNING id;
+                    """,
+                    (document_id, user_id)
+                )
+            else:
+                cur.execute(
+                    """
+                    DELETE FROM documents 
+                    WHERE id = %s AND user_id = %s 
+                    RETURNING id;
+                    """,
+                    (document_id, user_id)
+                )
+            deleted_id = cur.fetchone()
+            if deleted_id is not None:
+                generation = _bump_index_generation(cur, user_id)
+            conn.commit()
+
+    if deleted_id is not None:
+        bm25_index.remove_document(user_id, generation, str(deleted_id[0]))
+
+    # Returns True if a file was actually found and deleted
+    return deleted_id is not None
+
+
+def purge_deleted_chunks(batch_size: int = 1000) -> int:
+    # Hard-deletes up to batch_size chunks belonging to soft-deleted documents. Returns the number removed.
+    with get_connection() as conn:
+        with conn.cursor() as cur:
             cur.execute(
                 """
-                DELETE FROM documents 
-                WHERE id = %s AND user_id = %s 
-                RETURNING id;
+                DELETE FROM chunks
+                WHERE id IN (
+                    SELECT c.id
+                    FROM chunks c
+                    JOIN documents d ON c.document_id = d.id
+                    WHERE d.deleted_at IS NOT NULL
+                    LIMIT %s
+                );
                 """,
-                (document_id, user_id)
+                (batch_size,)
             )
-            deleted_id = cur.fetchone()
+            removed = cur.rowcount
             conn.commit()
-            
-            # Returns True if a file was actually found and deleted
-            return deleted_id is not None
+            return removed
+
+
+def purge_deleted_documents(batch_size: int = 1000) -> int:
+    # Hard-deletes soft-deleted documents whose chunks have already been purged.
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM documents
+                WHERE id IN (
+                    SELECT d.id
+                    FROM documents d
+                    WHERE d.deleted_at IS NOT NULL
+                      AND NOT EXISTS (SELECT 1 FROM chunks c WHERE c.document_id = d.id)
+                    LIMIT %s
+                );
+                """,
+                (batch_size,)
+            )
+            removed = cur.rowcount
+            conn.commit()
+            return removed
+
+
+def compact_chunk_storage(batch_size: int = 1000) -> int:
+    # Converts up to batch_size legacy chunks (full text in chunks.content) to offsets into their document.
+    # Chunks whose text can't be found in the document keep their content and are marked start_offset = -1.
+    # Offsets are found in Python with each document body read (and decompressed) once per batch.
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id, document_id, content
+                FROM chunks
+                WHERE start_offset IS NULL
+                ORDER BY document_id, chunk_index
+                LIMIT %s;
+                """,
+                (batch_size,)
+            )
+            by_doc: Dict[str, List[tuple]] = {}
+            for chunk_id, document_id, content in cur.fetchall():
+                by_doc.setdefault(document_id, []).append((chunk_id, content))
+            if not by_doc:
+                return 0
+
+            ids, starts, ends = [], [], []
+            for document_id, body in _iter_document_bodies(conn, list(by_doc)):
+                rows = by_doc[document_id]
+                for (chunk_id, _), offset in zip(rows, chunk_offsets(body, [content for _, content in rows])):
+                    ids.append(chunk_id)
+                    starts.append(offset[0] if offset else -1)
+                    ends.append(offset[1] if offset else None)
+
+            # Chunks losing their text get a stripped tsvector built from it first; the others keep matching on content
+            cur.execute(
+                """
+                UPDATE chunks c
+                SET content_tsv = CASE WHEN v.s >= 0 THEN strip(to_tsvector('english', c.content)) END,
+                    start_offset = v.s,
+                    end_offset = v.e,
+                    content = CASE WHEN v.s >= 0 THEN NULL ELSE c.content END
+                FROM unnest(%s::uuid[], %s::int[], %s::int[]) AS v(id, s, e)
+                WHERE c.id = v.id;
+                """,
+                (ids, starts, ends)
+            )
+            converted = cur.rowcount
+            conn.commit()
+            return converted
+
+
+def _iter_document_bodies(conn, document_ids: List) -> Iterator[tuple]:
+    # Streams (document_id, content) for the given documents a few at a time through a server-side cursor,
+    # so bulk readers decompress each body once instead of once per chunk (as substr() in SQL would).
+    with conn.cursor(name="document_bodies") as cur:
+        cur.itersize = 16
+        cur.execute("SELECT id, content FROM documents WHERE id = ANY(%s::uuid[]);", (document_ids,))
+        for document_id, content in cur:
+            yield document_id, content
+
+
+def run_maintenance(statement: str):
+    # Runs VACUUM / REINDEX style statements, which cannot execute inside a transaction block.
+    with psycopg.connect(**DB_PARAMS, autocommit=True) as conn:
+        conn.execute(statement)
+
+
+def acquire_advisory_lock(key: int) -> Optional[psycopg.Connection]:
+    # Takes a session-level advisory lock on a dedicated connection, for jobs that must run in one process only.
+    # Returns the connection, which holds the lock until it is closed, or None if another session holds it.
+    conn = psycopg.connect(**DB_PARAMS, autocommit=True)
+    if conn.execute("SELECT pg_try_advisory_lock(%s);", (key,)).fetchone()[0]:
+        return conn
+    conn.close()
+    return None
+
+
+def estimate_chunk_count() -> int:
+    # Planner estimate of live chunk rows; cheap, and exact enough to size maintenance thresholds.
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'chunks'::regclass;")
+            return max(cur.fetchone()[0], 0)
         
 
-def search_dense_chunks(user_id: str, query_vector: List[float], top_k: int = 5, threshold: float = 0.3, document_ids: Optional[List[str]] = None) -> List[dict]:
+def search_dense_chunks(user_id: str, query_vector: List[float], top_k: int = 5, threshold: float = 0.3, document_ids: Optional[List[str]] = None, ef_search: Optional[int] = None, exact: bool = False) -> List[dict]:
     # Finds the most similar chunks to a query vector using Cosine Distance (<=>).
+    # `exact` bypasses the HNSW index (sequential scan), which is only used to measure recall.
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(f"SET LOCAL hnsw.ef_search = {top_k * 10}")
+            cur.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search or top_k * 10)}")
+            if exact:
+                cur.execute("SET LOCAL enable_indexscan = off")
             
-            # 1. Base Query
-            base_query = """
+            # 1. Rank chunk ids by distance first; text is only materialized for the top_k rows that come back,
+            # since without the HNSW index (document filter, routed or exact searches) every candidate is scored
+            doc_filter = " AND d.id = ANY(%s::uuid[])" if document_ids else ""
+            base_query = f"""
                 SELECT
-                    c.content,
+                    {CHUNK_CONTENT_SQL},
                     d.filename,
-                    1 - (c.embedding <=> %s::vector) as similarity
-                FROM chunks c
+                    r.similarity
+                FROM (
+                    SELECT c.id, 1 - (c.embedding <=> %s::vector) as similarity
+                    FROM chunks c
+                    JOIN documents d ON c.document_id = d.id
+                    WHERE d.user_id = %s
+                      AND d.deleted_at IS NULL
+                      AND 1 - (c.embedding <=> %s::vector) >= %s{doc_filter}
+                    ORDER BY c.embedding <=> %s::vector
+                    LIMIT %s
+                ) r
+                JOIN chunks c ON c.id = r.id
                 JOIN documents d ON c.document_id = d.id
-                WHERE d.user_id = %s
-                  AND 1 - (c.embedding <=> %s::vector) >= %s
+                ORDER BY r.similarity DESC;
             """
             params = [query_vector, user_id, query_vector, threshold]
 
             # 2. Dynamically add the document filter if there are checked files
             if document_ids:
-                base_query += " AND d.id = ANY(%s::uuid[])"
                 params.append(document_ids)
 
-            # 3. Add the order and limit clauses
-            base_query += " ORDER BY c.embedding <=> %s::vector LIMIT %s;"
+            # 3. Order and limit parameters
             params.extend([query_vector, top_k])
 
             cur.execute(base_query, params)
@@ -153,35 +576,64 @@ def search_dense_chunks(user_id: str, query_vector: List[float], top_k: int = 5,
             return results
 
 
+def route_documents(user_id: str, query_vector: List[float], top_n: int = 10, document_ids: Optional[List[str]] = None) -> List[str]:
+    # Returns the ids of the top_n live documents whose centroid is closest to the query vector.
+    # Exact: the user's centroids are scanned and sorted, so a user always gets min(top_n, their documents) back.
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            base_query = """
+                SELECT d.id
+                FROM documents d
+                WHERE d.user_id = %s
+                  AND d.deleted_at IS NULL
+                  AND d.centroid IS NOT NULL
+            """
+            params = [user_id]
+
+            if document_ids:
+                base_query += " AND d.id = ANY(%s::uuid[])"
+                params.append(document_ids)
+
+            base_query += " ORDER BY d.centroid <=> %s::vector LIMIT %s;"
+            params.extend([query_vector, top_n])
+
+            cur.execute(base_query, params)
+            return [str(row[0]) for row in cur.fetchall()]
+
+
 def search_keyword_chunks(user_id: str, search_terms: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[dict]:
-    # Performs full-text search using PostgreSQL's ts_rank_cd.
+    # Performs full-text search using PostgreSQL's ts_rank.
     if not search_terms:
         return []
 
     with get_connection() as conn:
         with conn.cursor() as cur:
-            # 1. Base Query
-            base_query = """
+            # Rank chunk ids by keyword match first, then materialize text for the top_k winners only
+            doc_filter = " AND d.id = ANY(%s::uuid[])" if document_ids else ""
+            base_query = f"""
                 SELECT
-                    c.content,
+                    {CHUNK_CONTENT_SQL},
                     d.filename,
-                    ts_rank_cd(to_tsvector('english', c.content), query) as score,
+                    r.score,
                     c.id as chunk_id
-                FROM chunks c
+                FROM (
+                    SELECT c.id, ts_rank({KEYWORD_TSV_SQL}, query) as score
+                    FROM chunks c
+                    JOIN documents d ON c.document_id = d.id
+                    , to_tsquery('english', %s) query
+                    WHERE d.user_id = %s
+                      AND d.deleted_at IS NULL
+                      AND {keyword_match_sql("query")}{doc_filter}
+                    ORDER BY score DESC
+                    LIMIT %s
+                ) r
+                JOIN chunks c ON c.id = r.id
                 JOIN documents d ON c.document_id = d.id
-                , to_tsquery('english', %s) query
-                WHERE d.user_id = %s
-                  AND to_tsvector('english', c.content) @@ query
+                ORDER BY r.score DESC;
             """
             params = [search_terms, user_id]
-
-            # 2. Dynamically add the document filter if there are checked files
             if document_ids:
-                base_query += " AND d.id = ANY(%s::uuid[])"
                 params.append(document_ids)
-
-            # 3. Add the order and limit clauses
-            base_query += " ORDER BY score DESC LIMIT %s;"
             params.append(top_k)
 
             cur.execute(base_query, params)
@@ -199,6 +651,164 @@ def search_keyword_chunks(user_id: str, search_terms: str, top_k: int = 5, docum
             return results
 
 
+def search_dense_chunks_batch(user_id: str, query_vectors: List[List[float]], top_k: int = 5, threshold: float = 0.3, document_ids: Optional[List[str]] = None) -> List[List[dict]]:
+    # Runs search_dense_chunks for many query vectors in a single statement (one LATERAL HNSW scan per query).
+    # Like search_dense_chunks, the LATERAL ranks chunk ids only and text is materialized for the survivors.
+    if not query_vectors:
+        return []
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SET LOCAL hnsw.ef_search = {top_k * 10}")
+
+            doc_filter = " AND d.id = ANY(%s::uuid[])" if document_ids else ""
+            query = f"""
+                SELECT q.ord, {CHUNK_CONTENT_SQL}, d.filename, r.similarity
+                FROM (
+                    SELECT v::vector AS vec, ord
+                    FROM unnest(%s::text[]) WITH ORDINALITY AS t(v, ord)
+                ) q
+                CROSS JOIN LATERAL (
+                    SELECT
+                        c.id,
+                        1 - (c.embedding <=> q.vec) as similarity
+                    FROM chunks c
+                    JOIN documents d ON c.document_id = d.id
+                    WHERE d.user_id = %s
+                      AND d.deleted_at IS NULL{doc_filter}
+                    ORDER BY c.embedding <=> q.vec
+                    LIMIT %s
+                ) r
+                JOIN chunks c ON c.id = r.id
+                JOIN documents d ON c.document_id = d.id
+                WHERE r.similarity >= %s
+                ORDER BY q.ord, r.similarity DESC;
+            """
+            # Vectors travel as pgvector text literals so the whole batch fits in one text[] parameter
+            params = [[str(list(v)) for v in query_vectors], user_id]
+            if document_ids:
+                params.append(document_ids)
+            params.extend([top_k, threshold])
+
+            cur.execute(query, params)
+
+            results: List[List[dict]] = [[] for _ in query_vectors]
+            for ord_, content, filename, similarity in cur.fetchall():
+                results[ord_ - 1].append({
+                    "content": content,
+                    "filename": filename,
+                    "similarity": round(similarity, 3)
+                })
+            return results
+
+
+def search_keyword_chunks_batch(user_id: str, queries: List[str], top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[List[dict]]:
+    # Runs search_keyword_chunks for many queries in a single statement.
+    # Queries are raw text parsed with plainto_tsquery (AND of the words, like search_keyword_chunks does),
+    # so tsquery operators such as ( ! | : in one query can't fail the whole batch with a syntax error.
+    results: List[List[dict]] = [[] for _ in queries]
+    if not any(queries):
+        return results
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            doc_filter = " AND d.id = ANY(%s::uuid[])" if document_ids else ""
+            query = f"""
+                SELECT q.ord, {CHUNK_CONTENT_SQL}, d.filename, r.score, r.chunk_id
+                FROM (
+                    SELECT plainto_tsquery('english', t) AS query, ord
+                    FROM unnest(%s::text[]) WITH ORDINALITY AS s(t, ord)
+                    WHERE t <> ''
+                ) q
+                CROSS JOIN LATERAL (
+                    SELECT
+                        c.id as chunk_id,
+                        ts_rank({KEYWORD_TSV_SQL}, q.query) as score
+                    FROM chunks c
+                    JOIN documents d ON c.document_id = d.id
+                    WHERE d.user_id = %s
+                      AND d.deleted_at IS NULL
+                      AND {keyword_match_sql("q.query")}{doc_filter}
+                    ORDER BY score DESC
+                    LIMIT %s
+                ) r
+                JOIN chunks c ON c.id = r.chunk_id
+                JOIN documents d ON c.document_id = d.id
+                ORDER BY q.ord, r.score DESC;
+            """
+            params = [queries, user_id]
+            if document_ids:
+                params.append(document_ids)
+            params.append(top_k)
+
+            cur.execute(query, params)
+
+            for ord_, content, filename, score, chunk_id in cur.fetchall():
+                results[ord_ - 1].append({
+                    "content": content,
+                    "filename": filename,
+                    "score": float(score),
+                    "chunk_id": str(chunk_id)
+                })
+            return results
+
+
+def get_user_chunks_for_indexing(user_id: str) -> tuple:
+    # Returns (generation, [(chunk_id, document_id, content)]) for every live chunk a user owns. Used to build the BM25 index.
+    # The generation is read first, so a write racing with the load only makes the index look older than it is.
+    # Offset-stored chunks are sliced in Python from their document body, which is read once per document.
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT generation FROM search_index_generations WHERE user_id = %s;", (user_id,))
+            row = cur.fetchone()
+            generation = row[0] if row else 0
+
+            cur.execute(
+                """
+                SELECT c.id, c.document_id, c.content, c.start_offset, c.end_offset
+                FROM chunks c
+                JOIN documents d ON c.document_id = d.id
+                WHERE d.user_id = %s
+                  AND d.deleted_at IS NULL;
+                """,
+                (user_id,)
+            )
+            rows = []
+            spans: Dict[str, List[tuple]] = {}
+            for chunk_id, document_id, content, start, end in cur.fetchall():
+                if content is not None:
+                    rows.append((str(chunk_id), str(document_id), content))
+                else:
+                    spans.setdefault(document_id, []).append((chunk_id, start, end))
+
+            for document_id, body in _iter_document_bodies(conn, list(spans)):
+                for chunk_id, start, end in spans[document_id]:
+                    rows.append((str(chunk_id), str(document_id), body[start:end]))
+
+            return generation, rows
+
+
+def get_chunks_by_ids(user_id: str, chunk_ids: List[str]) -> Dict[str, dict]:
+    # Fetches content and filename for a set of chunk ids, keyed by chunk id.
+    if not chunk_ids:
+        return {}
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT c.id, {CHUNK_CONTENT_SQL}, d.filename
+                FROM chunks c
+                JOIN documents d ON c.document_id = d.id
+                WHERE d.user_id = %s
+                  AND d.deleted_at IS NULL
+                  AND c.id = ANY(%s::uuid[]);
+                """,
+                (user_id, chunk_ids)
+            )
+            return {str(row[0]): {"content": row[1], "filename": row[2]} for row in cur.fetchall()}
+
+
 # --- CONVERSATION MANAGEMENT ---
 def create_conversation(user_id: str, title: str) -> str:
     # Creates a new conversation and returns its UUID.
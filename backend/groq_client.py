@@ -1,5 +1,5 @@
 import os
-from groq import Groq
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,6 +10,9 @@ class GroqClient:
         if not api_key:
             raise ValueError("GROQ_API_KEY environment variable is missing from .env")
             
+        # The SDK is heavy to import, so it's loaded on first construction (normally the startup warm-up)
+        from groq import Groq
+
         self.client = Groq(api_key=api_key)
         self.model = "llama-3.1-8b-instant"
 
@@ -32,10 +35,14 @@ class GroqClient:
             stream=True
         )
 
-        for chunk in stream:
-            # Yield each piece of text as it arrives from the Groq servers
-            if chunk.choices[0].delta.content is not None:
-                yield chunk.choices[0].delta.content
+        try:
+            for chunk in stream:
+                # Yield each piece of text as it arrives from the Groq servers
+                if chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Closing the generator early (e.g. client disconnected) releases the upstream HTTP stream
+            stream.close()
     
     def generate_chat_title(self, user_query: str) -> str:
         # Generates a short (3-5 word) title based on the first user message.
@@ -71,4 +78,17 @@ class GroqClient:
             title = response.choices[0].message.content.strip().replace('"', '').replace("'", "")
             return title
         except Exception:
-            return "Untitled_Document"
\ No newline at end of file
+            return "Untitled_Document"
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_groq_client() -> GroqClient:
+    # Returns a process-wide GroqClient so requests reuse one SDK client and its HTTP connection pool.
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = GroqClient()
+    return _shared_client
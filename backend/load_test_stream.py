@@ -0,0 +1,116 @@
+# Load test for the SSE token transport. Runs many concurrent fake LLM streams, each producing tokens from a
+# worker thread like GroqClient.generate_stream under asyncio.to_thread, and reports frames/sec and CPU time per stream:
+#   - per-token: naive baseline, the worker hands every token to the loop (one wake-up and one SSE frame per token)
+#   - token:     STREAM_MODE=token as answer_events runs it, coalesce_tokens(flush_ms=0, flush_chars=1)
+#   - coalesced: STREAM_MODE=coalesced, coalesce_tokens with the configured flush window and frame size
+# No database, Ollama or Groq needed:
+#   python load_test_stream.py --streams 200 --tokens 400 --token-interval-ms 5
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from streaming import coalesce_tokens
+
+
+def fake_llm_stream(tokens: int, interval_ms: float):
+    # Blocking iterator shaped like GroqClient.generate_stream
+    for i in range(tokens):
+        if interval_ms:
+            time.sleep(interval_ms / 1000)
+        yield f" tok{i}"
+
+
+async def per_token_stream(tokens: int, interval_ms: float):
+    # The worker thread wakes the event loop once per token through a bounded queue (so slow readers still
+    # block it), and each token becomes its own SSE frame
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=256)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for token in fake_llm_stream(tokens, interval_ms):
+                if stop.is_set():
+                    return
+                asyncio.run_coroutine_threadsafe(queue.put(token), loop).result()
+        finally:
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(done), loop).result()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            token = await queue.get()
+            if token is done:
+                return
+            yield f"data: {json.dumps({'type': 'token', 'data': token})}\n\n"
+    finally:
+        stop.set()
+
+
+async def token_mode_stream(tokens: int, interval_ms: float):
+    # Same arguments answer_events uses for STREAM_MODE=token
+    async for text in coalesce_tokens(fake_llm_stream(tokens, interval_ms), flush_ms=0, flush_chars=1):
+        yield f"data: {json.dumps({'type': 'token', 'data': text})}\n\n"
+
+
+async def coalesced_stream(tokens: int, interval_ms: float):
+    async for text in coalesce_tokens(fake_llm_stream(tokens, interval_ms)):
+        yield f"data: {json.dumps({'type': 'token', 'data': text})}\n\n"
+
+
+MODES = {
+    "per-token": per_token_stream,
+    "token": token_mode_stream,
+    "coalesced": coalesced_stream,
+}
+
+
+async def client(stream, delay_ms: float) -> int:
+    frames = 0
+    async for _ in stream:
+        frames += 1
+        if delay_ms:
+            await asyncio.sleep(delay_ms / 1000)
+    return frames
+
+
+async def run(mode: str, streams: int, tokens: int, interval_ms: float, delay_ms: float) -> dict:
+    factory = MODES[mode]
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    frames = await asyncio.gather(*(client(factory(tokens, interval_ms), delay_ms) for _ in range(streams)))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    total_frames = sum(frames)
+    return {
+        "mode": mode,
+        "frames": total_frames,
+        "frames_per_stream": total_frames / streams,
+        "frames_per_sec": total_frames / wall,
+        "wall_s": wall,
+        "cpu_ms_per_stream": cpu * 1000 / streams,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-token, token-mode and coalesced SSE framing under concurrent load.")
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--token-interval-ms", type=float, default=0.0, help="Simulated LLM inter-token delay")
+    parser.add_argument("--client-delay-ms", type=float, default=0.0, help="Simulated slow reader, per frame")
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args()
+
+    for mode in args.modes.split(","):
+        r = asyncio.run(run(mode, args.streams, args.tokens, args.token_interval_ms, args.client_delay_ms))
+        print(
+            f"{r['mode']:>10}: {r['frames']} frames ({r['frames_per_stream']:.1f}/stream), "
+            f"{r['frames_per_sec']:.0f} frames/s, {r['wall_s']:.2f}s wall, {r['cpu_ms_per_stream']:.2f} ms CPU/stream"
+        )
@@ -1,26 +1,59 @@
 import os
 import re
 import uuid
+import zlib
+import asyncio
+import zipfile
+import tempfile
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
 import json
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from fastapi import Header
+from pydantic import BaseModel, Field
 from typing import Optional, List
 
 from ml.parser import parse_file
-from ml.chunker import recursive_chunker
+from ml.chunker import recursive_chunker, diff_chunks
 from ml.embedder import generate_embeddings
-from db import save_ingestion_data, get_all_documents, delete_document, create_conversation, add_message, get_user_conversations, get_conversation_messages, update_conversation_title, delete_conversation
+from db import save_ingestion_data, find_document_chunks, replace_ingestion_data, DocumentChanged, get_all_documents, delete_document, create_conversation, add_message, get_user_conversations, get_conversation_messages, update_conversation_title, delete_conversation
 
 from ml.dense_search import dense_search
 from ml.keyword_search import search_keywords
-from ml.hybrid_search import hybrid_search
+from ml.hybrid_search import hybrid_search, hybrid_search_batch
 from prompt_builder import build_rag_prompt
-from groq_client import GroqClient
+from groq_client import get_groq_client
+from db import SOFT_DELETE
+from compactor import compactor
+from bulk_ingest import run_bulk_ingestion, SUPPORTED_EXTENSIONS
+from streaming import coalesce_tokens, STREAM_MODE
+from warmup import warmup, WARMUP_ON_STARTUP
+from admission import admission, Overloaded
+from singleflight import stream_flights, title_flights
+from ml.search_tuning import search_tuner
+from ml.doc_routing import routing_monitor
+from profiling import ProfilingMiddleware, PROFILING_ENABLED, is_authorized, find_profile
+from body_limit import BodySizeLimitMiddleware
+
+MAX_FILE_SIZE_BYTES = 10 * 1024 * 1024 # 10 MB strict limit
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "200"))  # Files per bulk request, counting zip members
+BULK_MAX_TOTAL_BYTES = int(os.getenv("BULK_MAX_TOTAL_BYTES", str(200 * 1024 * 1024)))  # Uncompressed, per bulk request
+BULK_MAX_REQUEST_BYTES = int(os.getenv("BULK_MAX_REQUEST_BYTES", str(BULK_MAX_TOTAL_BYTES)))  # Raw request body, as sent
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024  # Form fields and part headers around the file data
+REPLACE_MAX_ATTEMPTS = 3  # Re-plans of a re-upload diff when concurrent uploads keep changing the document
 
 app = FastAPI(title="Hybrid RAG API")
 
+# Reject oversized uploads before the multipart form is parsed and spooled to disk.
+# Added before CORS so the 413 still carries CORS headers.
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        "/api/ingest": MAX_FILE_SIZE_BYTES + MULTIPART_OVERHEAD_BYTES,
+        "/api/ingest/bulk": BULK_MAX_REQUEST_BYTES + MULTIPART_OVERHEAD_BYTES,
+    },
+)
+
 # Configure CORS so Next.js is allowed to call this API
 app.add_middleware(
     CORSMiddleware,
@@ -28,9 +61,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id"],
 )
 
-MAX_FILE_SIZE_BYTES = 10 * 1024 * 1024 # 10 MB strict limit
+# Only installed when PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set, so it costs nothing otherwise
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # Warm the DB pool, embedding model and LLM client without blocking startup; see /ready
+    if WARMUP_ON_STARTUP:
+        app.state.warmup_task = asyncio.create_task(warmup.run())
+
+    # Soft-deleted documents are physically removed by the compactor
+    if SOFT_DELETE:
+        app.state.compactor_task = asyncio.create_task(compactor.run_forever())
 
 class QueryRequest(BaseModel):
     query: str
@@ -38,20 +85,55 @@ class QueryRequest(BaseModel):
     conversation_id: Optional[str] = None
     top_k: int = 5
     document_ids: Optional[List[str]] = None
+    keyword_engine: Optional[str] = None  # "ts_rank" or "bm25"; defaults to the KEYWORD_ENGINE env var
+    stream_mode: Optional[str] = None  # "coalesced" or "token"; defaults to the STREAM_MODE env var
+    latency_budget_ms: Optional[float] = None  # Lets the search tuner size ef_search and candidate pools
+    route_top_n: Optional[int] = Field(None, ge=0)  # Search only the N documents closest to the query; 0 = flat. Defaults to ROUTE_TOP_N
 
 class QueryResponse(BaseModel):
     answer: str
     sources: list[dict]
     chunks_found: int
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    user_id: str
+    top_k: int = 5
+    document_ids: Optional[List[str]] = None
+    keyword_engine: Optional[str] = None
+    retrieval_only: bool = False  # Skip generation, e.g. for recall evaluation
+
+class BatchQueryResult(QueryResponse):
+    error: Optional[str] = None
+
+class BatchQueryResponse(BaseModel):
+    results: list[BatchQueryResult]
+
 class UpdateConversationRequest(BaseModel):
     title: str
 
+BATCH_MAX_QUERIES = 500
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))  # Parallel Groq calls per batch request
+
+
+def format_sources(chunks: List[dict]) -> List[dict]:
+    return [
+        {
+            "filename": chunk["filename"],
+            "content_preview": chunk["content"][:200] + "...",
+            "score": chunk.get("score", 0), # Hybrid RRF Score
+            "similarity": chunk.get("similarity", 0) # Fallback/Debug info
+        }
+        for chunk in chunks
+    ]
+
 
 @app.post("/api/ingest")
 async def ingest_file(
     file: UploadFile = File(...),
-    user_id: str = Form(...) 
+    user_id: str = Form(...),
+    replace: bool = Form(False),  # Update an existing document instead of creating a new one
+    document_key: Optional[str] = Form(None)  # Identifies the document to replace; falls back to the filename
 ):
     # 1. Validation Checks
     if not file.filename:
@@ -73,7 +155,7 @@ async def ingest_file(
     if file.filename.startswith("snippet-"):
         try:
             text_preview = file_bytes.decode("utf-8")[:300]
-            groq = GroqClient()
+            groq = get_groq_client()
             new_title = groq.generate_document_title(text_preview)
             final_filename = f"{new_title}.txt"
         except Exception as e:
@@ -106,6 +188,51 @@ async def ingest_file(
         if not chunks:
              raise HTTPException(status_code=400, detail="File text is too short to process.")
         
+        # Re-upload: only embed chunks whose content hash isn't already stored for this document.
+        # The diff is planned from a snapshot and re-checked under a lock when applied; if a concurrent upload
+        # changed the document in between, plan again (already computed embeddings are kept).
+        existing = find_document_chunks(user_id, final_filename, document_key) if replace else None
+        new_embeddings = {}
+        for _ in range(REPLACE_MAX_ATTEMPTS if existing else 0):
+            _, to_embed, _ = diff_chunks(chunks, existing["chunk_hashes"])
+            to_embed = [i for i in to_embed if i not in new_embeddings]
+
+            try:
+                new_vectors = generate_embeddings([chunks[i] for i in to_embed]) if to_embed else []
+            except Exception as e:
+                raise HTTPException(status_code=503, detail=f"AI Service Error: {str(e)}")
+            new_embeddings.update(zip(to_embed, new_vectors))
+
+            try:
+                diff = replace_ingestion_data(
+                    user_id=user_id,
+                    document_id=existing["document_id"],
+                    filename=final_filename,
+                    content=clean_text,
+                    chunks=chunks,
+                    new_embeddings=new_embeddings,
+                    document_key=document_key
+                )
+            except DocumentChanged:
+                existing = find_document_chunks(user_id, final_filename, document_key)
+                if existing is None:
+                    break  # Deleted meanwhile: fall through and ingest as a new document
+                continue
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Database Transaction Failed: {str(e)}")
+
+            return {
+                "message": "File successfully updated.",
+                "document_id": diff["document_id"],
+                "filename": final_filename,
+                "chunks_created": diff["chunks_inserted"],
+                "chunks_reused": diff["chunks_reused"],
+                "chunks_deleted": diff["chunks_deleted"]
+            }
+
+        if existing:
+            raise HTTPException(status_code=409, detail="The document is being updated by another upload. Please try again.")
+
         # Step C: Embed
         try:
             embeddings = generate_embeddings(chunks)
@@ -120,7 +247,8 @@ async def ingest_file(
                 file_type=ext,
                 content=clean_text, 
                 chunks=chunks,
-                embeddings=embeddings
+                embeddings=embeddings,
+                document_key=document_key
             )
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database Transaction Failed: {str(e)}")
@@ -138,6 +266,143 @@ async def ingest_file(
             os.remove(temp_file_path)
 
 
+def _copy_limited(src, path: str, limit: int) -> Optional[int]:
+    # Streams src into path in blocks. Returns the bytes written, or None (and removes the file) past `limit`,
+    # so oversized files and zip bombs are never held in memory or fully written out.
+    written = 0
+    with open(path, "wb") as f:
+        while True:
+            block = src.read(1024 * 1024)
+            if not block:
+                return written
+            written += len(block)
+            if written > limit:
+                break
+            f.write(block)
+    os.remove(path)
+    return None
+
+
+def stage_bulk_uploads(files: List[UploadFile], temp_dir: str):
+    # Writes every supported upload and zip member to temp_dir. Returns ([(filename, path)], [rejected result]).
+    # Raises 413 when the request as a whole goes over BULK_MAX_FILES or BULK_MAX_TOTAL_BYTES.
+    staged = []
+    rejected = []
+    total = {"bytes": 0, "files": 0}
+
+    def reject(name: str, error: str):
+        rejected.append({"filename": os.path.basename(name), "status": "failed", "error": error})
+
+    def stage(name: str, src):
+        total["files"] += 1
+        if total["files"] > BULK_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Too many files. The limit is {BULK_MAX_FILES} per request.")
+
+        name = os.path.basename(name)
+        path = os.path.join(temp_dir, f"{total['files']}_{name}")
+        size = _copy_limited(src, path, MAX_FILE_SIZE_BYTES)
+        if size is None:
+            reject(name, "File too large.")
+            return
+        if size == 0:
+            os.remove(path)
+            reject(name, "The uploaded file is empty.")
+            return
+
+        total["bytes"] += size
+        if total["bytes"] > BULK_MAX_TOTAL_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload too large. The limit is {BULK_MAX_TOTAL_BYTES // (1024 * 1024)} MB per request.")
+        staged.append((name, path))
+
+    for upload in files:
+        if not upload.filename:
+            continue
+        ext = upload.filename.split('.')[-1].lower()
+
+        if ext == "zip":
+            try:
+                with zipfile.ZipFile(upload.file) as archive:
+                    for member in archive.infolist():
+                        if member.is_dir() or member.filename.split('.')[-1].lower() not in SUPPORTED_EXTENSIONS:
+                            continue
+                        if member.flag_bits & 0x1:
+                            reject(member.filename, "Encrypted files are not supported.")
+                            continue
+                        try:
+                            with archive.open(member) as src:
+                                stage(member.filename, src)
+                        except (RuntimeError, NotImplementedError, zipfile.BadZipFile, zlib.error, EOFError) as e:
+                            # Unsupported compression, corrupt data, bad CRC, ...
+                            reject(member.filename, f"Could not extract file from archive: {e}")
+            except zipfile.BadZipFile:
+                reject(upload.filename, "Invalid zip archive.")
+        elif ext in SUPPORTED_EXTENSIONS:
+            stage(upload.filename, upload.file)
+        else:
+            reject(upload.filename, "Unsupported file type. Only PDF, TXT, MD and ZIP are allowed.")
+
+    return staged, rejected
+
+
+@app.post("/api/ingest/bulk")
+async def ingest_files_bulk(
+    files: List[UploadFile] = File(...),
+    user_id: str = Form(...)
+):
+    # Ingests many files (or .zip archives of them) through the pipelined bulk ingestion stages.
+    with tempfile.TemporaryDirectory(prefix="bulk_") as temp_dir:
+        # Copying to disk and unpacking archives is blocking work, so it runs off the event loop too
+        staged, rejected = await asyncio.to_thread(stage_bulk_uploads, files, temp_dir)
+
+        if not staged and not rejected:
+            raise HTTPException(status_code=400, detail="No file provided.")
+
+        # The pipeline uses its own worker threads; keep the event loop free while it runs.
+        # A bulk ingest takes one of the global admission slots for its whole run.
+        try:
+            async with admission.slot():
+                results = await asyncio.to_thread(run_bulk_ingestion, user_id, staged)
+        except Overloaded:
+            raise HTTPException(status_code=429, detail="Server is busy. Please try again shortly.", headers={"Retry-After": "1"})
+
+    results += rejected
+    ingested = sum(1 for r in results if r["status"] == "ingested")
+    return {
+        "message": f"{ingested} of {len(results)} files successfully ingested.",
+        "files_ingested": ingested,
+        "files_failed": len(results) - ingested,
+        "results": results
+    }
+
+
+@app.get("/ready")
+async def readiness():
+    # Reports which subsystems have been warmed up. Returns 503 until all of them are ready.
+    # With WARMUP_ON_STARTUP=false there is nothing to wait for (used to measure cold first requests).
+    if not WARMUP_ON_STARTUP:
+        return {"ready": True, "warmup": "disabled"}
+    status = warmup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    # Downloads a stored request profile (see profiling.py).
+    if not is_authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Profiling is not enabled or the token is invalid.")
+
+    path = find_profile(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return FileResponse(path, filename=os.path.basename(path))
+
+
+@app.get("/api/search/stats")
+async def search_stats():
+    # Live numbers from the adaptive search tuner and the document router (sampled recall vs. exact/flat search).
+    return {"tuner": search_tuner.stats(), "routing": routing_monitor.stats()}
+
+
 # API endpoint to list all documents for a user
 @app.get("/api/documents")
 async def list_documents(user_id: str):
@@ -169,23 +434,19 @@ async def remove_document(document_id: str, user_id: str):
 # --- RAG QUERY ENDPOINTS ---
 @app.post("/api/query", response_model=QueryResponse)
 async def query_documents(request: QueryRequest):
+    try:
+        await admission.acquire()
+    except Overloaded:
+        raise HTTPException(status_code=429, detail="Server is busy. Please try again shortly.", headers={"Retry-After": "1"})
+
     try:
         # 1. Retrieve relevant chunks (Hybrid)
-        chunks = hybrid_search(request.query, request.user_id, request.top_k, request.document_ids)
+        chunks = await asyncio.to_thread(
+            hybrid_search, request.query, request.user_id, request.top_k, request.document_ids, request.keyword_engine, request.latency_budget_ms, request.route_top_n
+        )
 
         # 2. Format sources for the response
-        sources = [
-            {
-                "filename": chunk["filename"],
-                "content_preview": chunk["content"][:200] + "...",
-                
-                # Use the 'score' (RRF score) as the primary metric 
-                "score": chunk.get("score", 0), 
-                # 'similarity' is not directly comparable in hybrid search
-                "similarity": chunk.get("similarity", 0) 
-            }
-            for chunk in chunks
-        ]
+        sources = format_sources(chunks)
 
         if not chunks:
             return QueryResponse(
@@ -196,26 +457,126 @@ async def query_documents(request: QueryRequest):
 
         # 3. Build prompt and generate answer
         prompt = build_rag_prompt(request.query, chunks)
-        groq = GroqClient()
-        answer = groq.generate(prompt)
+        groq = get_groq_client()
+        answer = await asyncio.to_thread(groq.generate, prompt)
 
         return QueryResponse(answer=answer, sources=sources, chunks_found=len(chunks))
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+    finally:
+        admission.release()
+
+
+@app.post("/api/query/batch", response_model=BatchQueryResponse)
+async def query_documents_batch(request: BatchQueryRequest):
+    # Answers many queries at once: one embedding request, set-based retrieval, bounded parallel generation.
+    if not request.queries:
+        return BatchQueryResponse(results=[])
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"Too many queries. The limit is {BATCH_MAX_QUERIES} per batch.")
+
+    # Batches share the global admission limit: retrieval takes one slot, and so does each Groq call below
+    try:
+        async with admission.slot():
+            chunk_lists = await asyncio.to_thread(
+                hybrid_search_batch, request.queries, request.user_id, request.top_k, request.document_ids, request.keyword_engine
+            )
+    except Overloaded:
+        raise HTTPException(status_code=429, detail="Server is busy. Please try again shortly.", headers={"Retry-After": "1"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
+
+    if request.retrieval_only:
+        return BatchQueryResponse(results=[
+            BatchQueryResult(answer="", sources=format_sources(chunks), chunks_found=len(chunks))
+            for chunks in chunk_lists
+        ])
+
+    groq = get_groq_client()
+    semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+    async def answer(query: str, chunks: List[dict]) -> BatchQueryResult:
+        sources = format_sources(chunks)
+        if not chunks:
+            return BatchQueryResult(answer="I couldn't find any relevant information.", sources=[], chunks_found=0)
+
+        prompt = build_rag_prompt(query, chunks)
+        async with semaphore:
+            try:
+                async with admission.slot():
+                    text = await asyncio.to_thread(groq.generate, prompt)
+            except Overloaded:
+                return BatchQueryResult(answer="", sources=sources, chunks_found=len(chunks), error="Generation skipped: server is busy.")
+            except Exception as e:
+                # One failed generation shouldn't throw away the rest of the batch
+                return BatchQueryResult(answer="", sources=sources, chunks_found=len(chunks), error=f"Generation failed: {str(e)}")
+        return BatchQueryResult(answer=text, sources=sources, chunks_found=len(chunks))
+
+    results = await asyncio.gather(*(answer(q, chunks) for q, chunks in zip(request.queries, chunk_lists)))
+    return BatchQueryResponse(results=list(results))
+
+
+async def answer_events(request: QueryRequest, stream_mode: str):
+    # Retrieval + generation for one stream, as ("sources", [...]) followed by ("token", text) events.
+    chunks = await asyncio.to_thread(
+        hybrid_search, request.query, request.user_id, request.top_k, request.document_ids, request.keyword_engine, request.latency_budget_ms, request.route_top_n
+    )
+    yield ("sources", format_sources(chunks))
+
+    prompt = build_rag_prompt(request.query, chunks)
+    tokens = get_groq_client().generate_stream(prompt)
+
+    # The LLM stream is read off the event loop and paused when the client lags.
+    # "token" mode sends whatever has arrived straight away instead of waiting to fill a frame.
+    if stream_mode == "token":
+        frames = coalesce_tokens(tokens, flush_ms=0, flush_chars=1)
+    else:
+        frames = coalesce_tokens(tokens)
+
+    async for text in frames:
+        yield ("token", text)
+
+
+async def generate_title(query: str) -> str:
+    # One Groq call per burst of identical new conversations (see title_flights). Not under admission control:
+    # titles are coalesced per flight and only requested by a flight that was already admitted, so they are
+    # bounded by the admitted flights, and a second wait here would 429 a request that already holds a slot.
+    return await asyncio.to_thread(get_groq_client().generate_chat_title, query)
 
 
 @app.post("/api/query/stream")
 async def query_documents_stream(request: QueryRequest):
+    stream_mode = request.stream_mode or STREAM_MODE
+
+    # Identical in-flight requests share one retrieval and one LLM stream
+    flight_key = (
+        request.user_id,
+        request.query,
+        tuple(sorted(request.document_ids)) if request.document_ids else None,
+        request.top_k,
+        request.keyword_engine,
+        request.route_top_n,
+        stream_mode
+    )
+    try:
+        flight = await stream_flights.join_or_start(flight_key, lambda: answer_events(request, stream_mode))
+    except Overloaded:
+        raise HTTPException(status_code=429, detail="Server is busy. Please try again shortly.", headers={"Retry-After": "1"})
+
+    # Conversation setup runs while the flight is already retrieving. It is counted as a subscriber now,
+    # so if setup fails it has to leave again, or the flight would run on with nobody listening.
     conversation_id = request.conversation_id
     new_title = None
+    try:
+        if not conversation_id:
+            new_title = await title_flights.run(flight_key, lambda: generate_title(request.query))
+            conversation_id = await asyncio.to_thread(create_conversation, request.user_id, new_title)
 
-    if not conversation_id:
-        groq = GroqClient()
-        new_title = groq.generate_chat_title(request.query)
-        conversation_id = create_conversation(request.user_id, new_title)
-
-    add_message(conversation_id, "user", request.query)
+        await asyncio.to_thread(add_message, conversation_id, "user", request.query)
+    except BaseException:
+        flight.leave()
+        raise
 
     async def generate():
         try:
@@ -227,33 +588,19 @@ async def query_documents_stream(request: QueryRequest):
             })
             yield f"data: {meta_payload}\n\n"
 
-            # 1. Retrieve chunks (Hybrid)
-            chunks = hybrid_search(request.query, request.user_id, request.top_k, request.document_ids)
-
-            # 2. Send Sources 
-            sources = [
-                {
-                    "filename": chunk["filename"],
-                    "content_preview": chunk["content"][:200] + "...",
-                    "score": chunk.get("score", 0), # Hybrid RRF Score
-                    "similarity": chunk.get("similarity", 0) # Fallback/Debug info
-                }
-                for chunk in chunks
-            ]
-            sources_payload = json.dumps({"type": "sources", "data": sources})
-            yield f"data: {sources_payload}\n\n"
-
-            
-            prompt = build_rag_prompt(request.query, chunks)
-            groq = GroqClient()
-            
-            full_answer = "" 
-            for token in groq.generate_stream(prompt):
-                full_answer += token
-                token_payload = json.dumps({"type": "token", "data": token})
-                yield f"data: {token_payload}\n\n"
+            sources = []
+            answer_parts = []
+            async for kind, data in flight.subscribe():
+                if kind == "sources":
+                    sources = data
+                    sources_payload = json.dumps({"type": "sources", "data": sources})
+                    yield f"data: {sources_payload}\n\n"
+                else:
+                    answer_parts.append(data)
+                    token_payload = json.dumps({"type": "token", "data": data})
+                    yield f"data: {token_payload}\n\n"
             
-            add_message(conversation_id, "assistant", full_answer, sources)
+            add_message(conversation_id, "assistant", "".join(answer_parts), sources)
             yield f"data: {json.dumps({'type': 'done'})}\n\n"
 
         except Exception as e:
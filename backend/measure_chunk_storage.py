@@ -0,0 +1,148 @@
+# Measures what compact chunk storage (migrations/003_compact_chunks.sql) costs and saves:
+#   - on-disk size of the chunks and documents tables (heap, TOAST, indexes) and of each chunk column,
+#   - search_dense_chunks latency over real stored embeddings, which now materializes top-k text with substr().
+# Run it before and after `python migrate_compact_storage.py` and compare:
+#   python measure_chunk_storage.py --save before.json
+#   python migrate_compact_storage.py
+#   python measure_chunk_storage.py --compare before.json
+
+import argparse
+import json
+import statistics
+import time
+
+from db import get_connection, search_dense_chunks
+
+
+def measure_sizes() -> dict:
+    # Bytes per table part plus summed pg_column_size per chunk column (compressed, as stored).
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            sizes = {}
+            for table in ("chunks", "documents"):
+                cur.execute(
+                    """
+                    SELECT pg_relation_size(c.oid),
+                           COALESCE(pg_total_relation_size(NULLIF(c.reltoastrelid, 0)), 0),
+                           pg_indexes_size(c.oid),
+                           pg_total_relation_size(c.oid)
+                    FROM pg_class c WHERE c.oid = %s::regclass;
+                    """,
+                    (table,)
+                )
+                heap, toast, indexes, total = cur.fetchone()
+                sizes[table] = {"heap": heap, "toast": toast, "indexes": indexes, "total": total}
+
+            cur.execute(
+                """
+                SELECT count(*),
+                       COALESCE(sum(pg_column_size(content)), 0),
+                       COALESCE(sum(pg_column_size(content_tsv)), 0),
+                       COALESCE(sum(pg_column_size(embedding)), 0),
+                       count(*) FILTER (WHERE content IS NULL)
+                FROM chunks;
+                """
+            )
+            rows, content, tsv, embedding, offset_rows = cur.fetchone()
+            sizes["chunk_columns"] = {
+                "rows": rows,
+                "offset_stored_rows": offset_rows,
+                "content": content,
+                "content_tsv": tsv,
+                "embedding": embedding,
+            }
+            return sizes
+
+
+def measure_dense_search(samples: int, top_k: int, seed: int) -> dict:
+    # Times search_dense_chunks with stored chunk embeddings as queries, so every query has real neighbours.
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            # Hash order rather than random(): the same chunks are picked even after the migration moves rows
+            cur.execute(
+                """
+                SELECT d.user_id, c.embedding
+                FROM chunks c
+                JOIN documents d ON c.document_id = d.id
+                WHERE d.deleted_at IS NULL
+                ORDER BY md5(c.id::text || %s)
+                LIMIT %s;
+                """,
+                (str(seed), samples)
+            )
+            queries = cur.fetchall()
+
+    if not queries:
+        return {"samples": 0}
+
+    search_dense_chunks(queries[0][0], queries[0][1], top_k)  # Warm the pool and caches
+    latencies = []
+    for user_id, vector in queries:
+        start = time.perf_counter()
+        search_dense_chunks(user_id, vector, top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    return {
+        "samples": len(latencies),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+        "mean_ms": statistics.fmean(latencies),
+    }
+
+
+def mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} MB"
+
+
+def report(result: dict, baseline: dict = None):
+    def delta(path):
+        if baseline is None:
+            return ""
+        old, new = baseline, result
+        for key in path:
+            old, new = old[key], new[key]
+        if not old:
+            return ""
+        return f"  ({(new - old) / old * 100:+.1f}%)"
+
+    for table in ("chunks", "documents"):
+        parts = ", ".join(f"{part} {mb(result['sizes'][table][part])}" for part in ("heap", "toast", "indexes"))
+        print(f"{table:>10}: total {mb(result['sizes'][table]['total'])}{delta(('sizes', table, 'total'))} ({parts})")
+
+    columns = result["sizes"]["chunk_columns"]
+    print(f"{'columns':>10}: {columns['rows']} chunks, {columns['offset_stored_rows']} stored as offsets")
+    for column in ("content", "content_tsv", "embedding"):
+        print(f"{'':>12}{column}: {mb(columns[column])}{delta(('sizes', 'chunk_columns', column))}")
+
+    dense = result["dense_search"]
+    if dense["samples"]:
+        print(
+            f"{'dense':>10}: p50 {dense['p50_ms']:.2f} ms{delta(('dense_search', 'p50_ms'))}, "
+            f"p95 {dense['p95_ms']:.2f} ms{delta(('dense_search', 'p95_ms'))} over {dense['samples']} queries"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report chunk storage footprint and search_dense_chunks latency.")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7, help="Same seed picks the same query chunks across runs")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Print changes relative to a JSON file written with --save")
+    args = parser.parse_args()
+
+    result = {
+        "sizes": measure_sizes(),
+        "dense_search": measure_dense_search(args.samples, args.top_k, args.seed),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,119 @@
+# Measures what the startup warm-up buys: import time of the app, and latency of the first /api/query after
+# the server starts, with WARMUP_ON_STARTUP=false (cold) and =true (waiting for /ready before the request).
+# Needs the full environment (database, Ollama, GROQ_API_KEY) and a user with ingested documents:
+#   python measure_startup.py --user-id <uuid> --query "What is this document about?" --runs 3
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure_imports(module: str, top: int) -> dict:
+    # Runs `python -X importtime -c "import <module>"` in a fresh interpreter and returns its total import time
+    # plus the slowest of the modules it imports directly, by cumulative time, in milliseconds.
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+
+    # A module's own imports are listed right before it, indented one level (two spaces) deeper
+    children = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        depth = (len(match.group(3)) - 1) // 2
+        name, cumulative_ms = match.group(4), int(match.group(2)) / 1000
+        if depth == 1:
+            children.append((name, cumulative_ms))
+        elif depth == 0:
+            if name == module:
+                slowest = sorted(children, key=lambda item: item[1], reverse=True)[:top]
+                return {"total_ms": cumulative_ms, "slowest": slowest}
+            children = []
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def http(method: str, url: str, body: dict = None, timeout: float = 120.0):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def measure_first_request(warmup: bool, port: int, payload: dict, ready_timeout: float) -> dict:
+    # Starts uvicorn, waits until /ready answers 200, then times the first and second /api/query.
+    env = {**os.environ, "WARMUP_ON_STARTUP": "true" if warmup else "false"}
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    try:
+        while True:
+            if time.perf_counter() - started > ready_timeout:
+                raise RuntimeError("Server did not become ready in time")
+            if server.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            try:
+                status, _ = http("GET", f"{base}/ready", timeout=1.0)
+                if status == 200:
+                    break
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                pass
+            time.sleep(0.05)
+        ready_ms = (time.perf_counter() - started) * 1000
+
+        latencies = []
+        for _ in range(2):
+            start = time.perf_counter()
+            status, body = http("POST", f"{base}/api/query", payload)
+            if status != 200:
+                raise RuntimeError(f"/api/query returned {status}: {body[:500]!r}")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        return {"ready_ms": ready_ms, "first_ms": latencies[0], "second_ms": latencies[1]}
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import time and first-request latency with and without warm-up.")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--query", default="What is this document about?")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--top-imports", type=int, default=10)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    imports = [measure_imports("main", args.top_imports) for _ in range(args.runs)]
+    print(f"import main: median {statistics.median(r['total_ms'] for r in imports):.1f} ms over {args.runs} runs")
+    for name, ms in imports[-1]["slowest"]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    payload = {"query": args.query, "user_id": args.user_id}
+    for warmup in (False, True):
+        runs = [measure_first_request(warmup, args.port, payload, args.ready_timeout) for _ in range(args.runs)]
+        label = "warm-up on " if warmup else "warm-up off"
+        print(
+            f"{label}: ready after {statistics.median(r['ready_ms'] for r in runs):.0f} ms, "
+            f"first query {statistics.median(r['first_ms'] for r in runs):.0f} ms, "
+            f"second query {statistics.median(r['second_ms'] for r in runs):.0f} ms (medians of {args.runs})"
+        )
@@ -0,0 +1,27 @@
+# Converts existing chunks to offset-based storage in small batches (run after migrations/003_compact_chunks.sql).
+# Safe to stop and re-run at any time: reads work for both layouts while the conversion is in progress.
+#   python migrate_compact_storage.py --batch-size 1000
+
+import argparse
+
+from db import compact_chunk_storage, run_maintenance
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move chunk text into offsets over the parent document body.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--skip-vacuum", action="store_true")
+    args = parser.parse_args()
+
+    total = 0
+    while True:
+        converted = compact_chunk_storage(args.batch_size)
+        if converted == 0:
+            break
+        total += converted
+        print(f"Converted {total} chunks...")
+
+    print(f"Done: {total} chunks converted.")
+
+    if not args.skip_vacuum:
+        # Makes the freed space reusable; use VACUUM FULL in a maintenance window to return it to the OS
+        run_maintenance("VACUUM (ANALYZE) chunks")
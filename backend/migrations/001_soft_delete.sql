@@ -0,0 +1,13 @@
+-- Soft delete: documents are flagged with deleted_at and hidden from every read path.
+-- compactor.py later removes the flagged documents and their chunks in bounded batches.
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
+
+-- Live-document lookups (listing, search joins) only ever touch rows with deleted_at IS NULL
+CREATE INDEX IF NOT EXISTS documents_user_live_idx ON documents (user_id) WHERE deleted_at IS NULL;
+
+-- Lets the compactor find pending work without scanning the whole table
+CREATE INDEX IF NOT EXISTS documents_deleted_idx ON documents (deleted_at) WHERE deleted_at IS NOT NULL;
+
+-- Lets the compactor find a document's chunks quickly
+CREATE INDEX IF NOT EXISTS chunks_document_id_idx ON chunks (document_id);
@@ -0,0 +1,11 @@
+-- Incremental re-ingestion: chunks are matched across uploads by content hash,
+-- and documents can optionally be identified by a client-supplied key instead of their filename.
+
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS document_key TEXT;
+
+-- Must match ml/chunker.py:chunk_hash (hex sha256 of the UTF-8 text)
+UPDATE chunks SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex') WHERE content_hash IS NULL;
+
+CREATE INDEX IF NOT EXISTS documents_user_key_idx ON documents (user_id, document_key) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS documents_user_filename_idx ON documents (user_id, filename) WHERE deleted_at IS NULL;
@@ -0,0 +1,25 @@
+-- Compact chunk storage: chunks reference their text as (start_offset, end_offset) into documents.content
+-- instead of storing a second copy of it.
+-- start_offset = -1 marks a chunk that keeps its own text in chunks.content.
+-- Only chunks stored as offsets get a content_tsv, and it is strip()ped (lexemes without positions, a fraction
+-- of a full tsvector) so keyword search can match them without slicing the document. Chunks that keep their
+-- text are searched through an expression index on it, so nothing is stored for them twice.
+
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS start_offset INTEGER;
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS end_offset INTEGER;
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector;
+ALTER TABLE chunks ALTER COLUMN content DROP NOT NULL;
+
+-- content_tsv is only set on offset-stored chunks, filled in by migrate_compact_storage.py as it converts them
+CREATE INDEX IF NOT EXISTS chunks_content_tsv_idx ON chunks USING GIN (content_tsv) WHERE content_tsv IS NOT NULL;
+CREATE INDEX IF NOT EXISTS chunks_content_fts_idx ON chunks USING GIN (to_tsvector('english', content)) WHERE content IS NOT NULL;
+
+-- Document bodies are now the only copy of the text; lz4 (PostgreSQL 14+) is cheap to slice for substr()
+-- and applies to values written from now on.
+ALTER TABLE documents ALTER COLUMN content SET COMPRESSION lz4;
+
+-- Lets migrate_compact_storage.py find the chunks it still has to convert; shrinks to nothing as it goes
+CREATE INDEX IF NOT EXISTS chunks_legacy_idx ON chunks (document_id, chunk_index) WHERE start_offset IS NULL;
+
+-- Existing chunks are converted in batches afterwards with: python migrate_compact_storage.py
+-- measure_chunk_storage.py reports table/column sizes and search_dense_chunks latency before and after.
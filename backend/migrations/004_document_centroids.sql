@@ -0,0 +1,13 @@
+-- Coarse-to-fine retrieval: each document keeps the mean of its chunk embeddings so queries can be
+-- routed to the closest documents before chunk-level search. Dimension matches nomic-embed-text.
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS centroid vector(768);
+
+UPDATE documents d
+SET centroid = (SELECT avg(c.embedding) FROM chunks c WHERE c.document_id = d.id)
+WHERE d.centroid IS NULL;
+
+-- No ANN index on centroid: a global HNSW index filtered by user_id afterwards returns far fewer than N
+-- documents for users who own a small share of the table. route_documents scans the user's live documents
+-- exactly instead (via documents_user_live_idx), which is cheap for a few hundred centroids.
+DROP INDEX IF EXISTS documents_centroid_idx;
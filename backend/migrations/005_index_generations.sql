@@ -0,0 +1,8 @@
+-- Cross-process invalidation for the in-memory BM25 index (ml/bm25_index.py).
+-- Every write to a user's live chunks bumps that user's generation in the same transaction; each server
+-- process compares it with the generation its cached index was built from and rebuilds when it's behind.
+
+CREATE TABLE IF NOT EXISTS search_index_generations (
+    user_id TEXT PRIMARY KEY,
+    generation BIGINT NOT NULL DEFAULT 0
+);
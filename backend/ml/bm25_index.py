@@ -0,0 +1,250 @@
+# In-memory BM25 inverted index used as an alternative to PostgreSQL's ts_rank_cd keyword search.
+# Each user gets their own partition: term -> postings (chunk_id -> term frequency), plus per-chunk
+# lengths and corpus statistics. Partitions are loaded lazily from the database on first use, kept up to date
+# incrementally by save_ingestion_data / replace_ingestion_data / delete_document, and rebuilt when another
+# process has written to the user's documents since. At most BM25_MAX_INDEXED_CHUNKS chunks stay in memory.
+
+import heapq
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+BM25_MAX_INDEXED_CHUNKS = int(os.getenv("BM25_MAX_INDEXED_CHUNKS", "500000"))  # Across all users in this process
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "he", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "to", "was", "were", "will", "with", "what", "which",
+    "who", "how", "why", "when", "where", "do", "does", "did", "this", "these", "those", "i", "you",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    # Lowercases the text and splits it into alphanumeric terms, dropping stopwords.
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class UserIndex:
+    # Inverted index for the chunks of a single user.
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}  # term -> {chunk_id: tf}
+        self.max_tf: Dict[str, int] = {}               # term -> highest tf seen (upper bound, may be stale-high)
+        self.doc_len: Dict[str, int] = {}              # chunk_id -> number of terms
+        self.chunk_doc: Dict[str, str] = {}            # chunk_id -> document_id
+        self.doc_chunks: Dict[str, List[str]] = {}     # document_id -> [chunk_id]
+        self.chunk_terms: Dict[str, List[str]] = {}    # chunk_id -> distinct terms, so deletes skip the full vocabulary
+        self.total_len = 0
+        self.generation = 0                            # Search index generation these postings reflect
+
+    def add_chunk(self, chunk_id: str, document_id: str, text: str):
+        if chunk_id in self.doc_len:
+            return  # Already indexed (e.g. picked up by the initial load)
+
+        terms = tokenize(text)
+        counts: Dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+            if tf > self.max_tf.get(term, 0):
+                self.max_tf[term] = tf
+
+        self.doc_len[chunk_id] = len(terms)
+        self.chunk_terms[chunk_id] = list(counts)
+        self.total_len += len(terms)
+        self.chunk_doc[chunk_id] = document_id
+        self.doc_chunks.setdefault(document_id, []).append(chunk_id)
+
+    def remove_chunk(self, chunk_id: str):
+        for term in self.chunk_terms.pop(chunk_id, []):
+            plist = self.postings.get(term)
+            if plist is None:
+                continue
+            plist.pop(chunk_id, None)
+            if not plist:
+                del self.postings[term]
+                self.max_tf.pop(term, None)
+
+        self.total_len -= self.doc_len.pop(chunk_id, 0)
+        document_id = self.chunk_doc.pop(chunk_id, None)
+        siblings = self.doc_chunks.get(document_id)
+        if siblings is not None and chunk_id in siblings:
+            siblings.remove(chunk_id)
+
+    def remove_document(self, document_id: str):
+        for chunk_id in list(self.doc_chunks.pop(document_id, [])):
+            self.remove_chunk(chunk_id)
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        document_ids: Optional[List[str]] = None,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> List[Tuple[str, float]]:
+        # Returns [(chunk_id, bm25_score)] using OR semantics with MaxScore-style early termination.
+        n_docs = len(self.doc_len)
+        if n_docs == 0 or top_k <= 0:
+            return []
+
+        avgdl = self.total_len / n_docs if self.total_len else 1.0
+        allowed = set(document_ids) if document_ids else None
+
+        # Collect each distinct query term with its idf and an upper bound on its contribution
+        terms = []
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            df = len(plist)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            max_tf = self.max_tf[term]
+            upper_bound = idf * max_tf * (k1 + 1) / (max_tf + k1 * (1 - b))
+            terms.append((upper_bound, idf, plist))
+
+        if not terms:
+            return []
+
+        # Highest-impact terms first, so the cheap-to-skip tail comes last
+        terms.sort(key=lambda t: t[0], reverse=True)
+        remaining_bound = [0.0] * (len(terms) + 1)
+        for i in range(len(terms) - 1, -1, -1):
+            remaining_bound[i] = remaining_bound[i + 1] + terms[i][0]
+
+        scores: Dict[str, float] = {}
+        threshold = 0.0
+
+        for i, (_, idf, plist) in enumerate(terms):
+            # Once no unseen chunk can beat the current k-th best score, stop admitting new candidates
+            # and only refine the scores of chunks we are already tracking.
+            admit_new = len(scores) < top_k or remaining_bound[i] > threshold
+
+            if admit_new:
+                candidates = plist.items()
+            else:
+                candidates = ((cid, plist[cid]) for cid in list(scores) if cid in plist)
+
+            for chunk_id, tf in candidates:
+                if allowed is not None and self.chunk_doc.get(chunk_id) not in allowed:
+                    continue
+                norm = k1 * (1 - b + b * self.doc_len[chunk_id] / avgdl)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+            if len(scores) >= top_k:
+                threshold = heapq.nlargest(top_k, scores.values())[-1]
+                # Drop candidates that can no longer reach the top-k even with every remaining term
+                if not admit_new or remaining_bound[i + 1] <= threshold:
+                    bound = remaining_bound[i + 1]
+                    scores = {cid: s for cid, s in scores.items() if s + bound >= threshold}
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+class BM25Index:
+    # Process-wide registry of per-user indexes, kept as a bounded LRU.
+    # Every index remembers the user's search index generation it reflects (see migrations/005_index_generations.sql).
+    # Each write bumps that counter in its own transaction, so a process that didn't serve a write sees a
+    # newer generation on its next search and rebuilds instead of ranking stale or deleted chunks.
+
+    def __init__(self, max_chunks: int = BM25_MAX_INDEXED_CHUNKS):
+        self.max_chunks = max_chunks
+        self._users: "OrderedDict[str, UserIndex]" = OrderedDict()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+
+    def _lock_for(self, user_id: str) -> threading.Lock:
+        with self._registry_lock:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def _get(self, user_id: str) -> Optional[UserIndex]:
+        with self._registry_lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+            return index
+
+    def _put(self, user_id: str, index: UserIndex):
+        with self._registry_lock:
+            self._users[user_id] = index
+            self._users.move_to_end(user_id)
+            # Evict least recently searched users until the total fits; the newest index always stays
+            total = sum(len(i.doc_len) for i in self._users.values())
+            while total > self.max_chunks and len(self._users) > 1:
+                _, evicted = self._users.popitem(last=False)
+                total -= len(evicted.doc_len)
+
+    def _drop(self, user_id: str):
+        with self._registry_lock:
+            self._users.pop(user_id, None)
+
+    def ensure_loaded(self, user_id: str, generation: int, loader: Callable[[str], Tuple[int, Iterable[Tuple[str, str, str]]]]):
+        # Makes sure the user's index reflects at least `generation`, the counter currently stored in the database.
+        # `loader(user_id)` -> (generation, [(chunk_id, document_id, content)]) rebuilds it when it is missing or stale.
+        index = self._get(user_id)
+        if index is not None and index.generation >= generation:
+            return
+        with self._lock_for(user_id):
+            index = self._get(user_id)
+            if index is not None and index.generation >= generation:
+                return
+            loaded_generation, rows = loader(user_id)
+            index = UserIndex()
+            for chunk_id, document_id, content in rows:
+                index.add_chunk(chunk_id, document_id, content)
+            index.generation = loaded_generation
+            self._put(user_id, index)
+
+    def apply(self, user_id: str, generation: int, change: Callable[[UserIndex], None]):
+        # Applies a committed write (which moved the user to `generation`) to a loaded index.
+        # If this process missed an earlier write the index is dropped and rebuilt on the next search.
+        with self._lock_for(user_id):
+            index = self._get(user_id)
+            if index is None or index.generation >= generation:
+                return  # Not loaded, or already rebuilt from rows that include this write
+            if index.generation != generation - 1:
+                self._drop(user_id)
+                return
+            change(index)
+            index.generation = generation
+
+    def add_chunks(self, user_id: str, generation: int, document_id: str, chunks: Iterable[Tuple[str, str]]):
+        # Indexes [(chunk_id, content)] for a freshly saved document.
+        chunks = list(chunks)
+
+        def change(index: UserIndex):
+            for chunk_id, content in chunks:
+                index.add_chunk(chunk_id, document_id, content)
+
+        self.apply(user_id, generation, change)
+
+    def replace_chunks(self, user_id: str, generation: int, document_id: str, removed: Iterable[str], added: Iterable[Tuple[str, str]]):
+        # Applies a re-upload diff: drops `removed` chunk ids and indexes `added` [(chunk_id, content)].
+        removed, added = list(removed), list(added)
+
+        def change(index: UserIndex):
+            for chunk_id in removed:
+                index.remove_chunk(chunk_id)
+            for chunk_id, content in added:
+                index.add_chunk(chunk_id, document_id, content)
+
+        self.apply(user_id, generation, change)
+
+    def remove_document(self, user_id: str, generation: int, document_id: str):
+        self.apply(user_id, generation, lambda index: index.remove_document(document_id))
+
+    def search(self, user_id: str, query: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        with self._lock_for(user_id):
+            index = self._get(user_id)
+            if index is None:
+                return []
+            return index.search(query, top_k, document_ids)
+
+
+bm25_index = BM25Index()
@@ -1,4 +1,5 @@
-from typing import List, Optional
+import hashlib
+from typing import Dict, List, Optional, Tuple
 
 def recursive_chunker(
     text: str, 
@@ -60,4 +61,45 @@ def recursive_chunker(
     if current_group:
         chunks.append(current_group)
         
-    return chunks
\ No newline at end of file
+    return chunks
+
+
+def chunk_hash(text: str) -> str:
+    # Stable content hash used to match chunks across re-ingestions (same as sha256() in migrations/002).
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def diff_chunks(chunks: List[str], existing_hashes: Dict[str, List[str]]) -> Tuple[List[Tuple[str, int]], List[int], List[str]]:
+    # Matches new chunks against stored ones by content hash.
+    # Returns (reused [(chunk_id, new_index)], positions that need embedding, vanished chunk_ids).
+    available = {h: list(ids) for h, ids in existing_hashes.items()}
+    reused = []
+    to_embed = []
+
+    for i, chunk_text in enumerate(chunks):
+        ids = available.get(chunk_hash(chunk_text))
+        if ids:
+            reused.append((ids.pop(0), i))
+        else:
+            to_embed.append(i)
+
+    vanished = [chunk_id for ids in available.values() for chunk_id in ids]
+    return reused, to_embed, vanished
+
+
+def chunk_offsets(text: str, chunks: List[str]) -> List[Optional[Tuple[int, int]]]:
+    # Locates each chunk in the text it was cut from and returns its (start, end) character offsets,
+    # or None if it can't be found. Chunks are contiguous, in order and may overlap, so each search
+    # starts at the previous chunk's start.
+    offsets = []
+    cursor = 0
+    for chunk in chunks:
+        start = text.find(chunk, cursor)
+        if start == -1:
+            start = text.find(chunk)
+        if start == -1:
+            offsets.append(None)
+            continue
+        offsets.append((start, start + len(chunk)))
+        cursor = start
+    return offsets
@@ -2,24 +2,65 @@
 
 from typing import List, Optional
 from ml.embedder import generate_embeddings
-from db import search_dense_chunks
+from db import search_dense_chunks, search_dense_chunks_batch
+from ml.search_tuning import search_tuner, timed
 
-def dense_search(query: str, user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[dict]:    
+def embed_query(query: str) -> Optional[List[float]]:
     try:
         query_embeddings = generate_embeddings([query])
         if not query_embeddings:
-            return []
+            return None
             
-        query_vector = query_embeddings[0]
+        return query_embeddings[0]
     except Exception as e:
         raise RuntimeError(f"Failed to embed query: {e}")
+
+def dense_search(query: str, user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None, ef_search: Optional[int] = None, query_vector: Optional[List[float]] = None) -> List[dict]:    
+    # Callers that already embedded the query (e.g. for document routing) pass query_vector to skip a second request
+    if query_vector is None:
+        query_vector = embed_query(query)
+        if query_vector is None:
+            return []
         
-    # Search the database using the new vector
-    relevant_chunks = search_dense_chunks(
-        user_id=user_id, 
-        query_vector=query_vector, 
-        top_k=top_k,
-        document_ids=document_ids
+    # Search the database using the new vector. Every search counts as load for the tuner and reports its
+    # latency; untuned ones run at search_dense_chunks' default ef_search.
+    if ef_search is None:
+        return timed(
+            lambda: search_dense_chunks(user_id=user_id, query_vector=query_vector, top_k=top_k, document_ids=document_ids),
+            top_k * 10
+        )
+
+    # Tuned search: additionally check recall against an exact scan now and then
+    relevant_chunks = timed(
+        lambda: search_dense_chunks(user_id, query_vector, top_k, document_ids=document_ids, ef_search=ef_search),
+        ef_search
+    )
+    search_tuner.maybe_sample(
+        ef_search,
+        relevant_chunks,
+        lambda: search_dense_chunks(user_id, query_vector, top_k, document_ids=document_ids, exact=True)
     )
     
-    return relevant_chunks
\ No newline at end of file
+    return relevant_chunks
+
+def dense_search_batch(queries: List[str], user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[List[dict]]:
+    # Embeds every query in one request and searches for all of them in one SQL statement.
+    if not queries:
+        return []
+
+    try:
+        query_vectors = generate_embeddings(queries)
+    except Exception as e:
+        raise RuntimeError(f"Failed to embed queries: {e}")
+
+    if len(query_vectors) != len(queries):
+        raise RuntimeError("Failed to embed queries: embedding count does not match query count")
+
+    # One statement on one connection, so it counts as a single search in flight
+    with search_tuner.tracking():
+        return search_dense_chunks_batch(
+            user_id=user_id,
+            query_vectors=query_vectors,
+            top_k=top_k,
+            document_ids=document_ids
+        )
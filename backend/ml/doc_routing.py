@@ -0,0 +1,62 @@
+# Coarse-to-fine retrieval: route a query to the documents whose centroid embedding is closest,
+# then run chunk-level search only inside them. A sample of routed searches is re-run as a flat
+# search in the background so the recall cost of routing stays visible (see routing_monitor.stats()).
+# Like the exact-scan recall probes in search_tuning.py, only MAX_ROUTING_PROBES of those run at once and none
+# start while dense search is over its load threshold.
+
+import os
+import random
+import threading
+from typing import Callable, List
+
+from ml.search_tuning import search_tuner, LOAD_THRESHOLD
+
+ROUTE_TOP_N = int(os.getenv("ROUTE_TOP_N", "0"))                                 # 0 disables routing by default
+ROUTING_RECALL_SAMPLE_RATE = float(os.getenv("ROUTING_RECALL_SAMPLE_RATE", "0.02"))
+MAX_ROUTING_PROBES = int(os.getenv("MAX_ROUTING_PROBES", "1"))                  # Flat comparison searches running at once
+EWMA_ALPHA = 0.1
+
+
+class RoutingMonitor:
+    def __init__(self):
+        self.recall = None  # EWMA of |routed ∩ flat| / |flat| over sampled queries
+        self.samples = 0
+        self.probing = 0
+        self._lock = threading.Lock()
+
+    def record(self, value: float):
+        with self._lock:
+            self.recall = value if self.recall is None else (1 - EWMA_ALPHA) * self.recall + EWMA_ALPHA * value
+            self.samples += 1
+
+    def maybe_sample(self, routed: List[dict], flat_search: Callable[[], List[dict]]):
+        if random.random() >= ROUTING_RECALL_SAMPLE_RATE:
+            return
+        with self._lock:
+            if self.probing >= MAX_ROUTING_PROBES or search_tuner.in_flight > LOAD_THRESHOLD:
+                return
+            self.probing += 1
+
+        # Snapshot now: RRF results are shared dicts and may be mutated by the caller later
+        routed_keys = {doc['content'] for doc in routed}
+
+        def run():
+            try:
+                flat = flat_search()
+            except Exception as e:
+                print(f"Routing recall sampling failed: {e}")
+                return
+            finally:
+                with self._lock:
+                    self.probing -= 1
+            if flat:
+                self.record(sum(1 for doc in flat if doc['content'] in routed_keys) / len(flat))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"recall_vs_flat": self.recall, "samples": self.samples, "probing": self.probing}
+
+
+routing_monitor = RoutingMonitor()
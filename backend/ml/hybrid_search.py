@@ -1,13 +1,75 @@
 # Combines Dense (Vector) and Sparse (Keyword) search results using Reciprocal Rank Fusion (RRF).
 
+import os
 from typing import List, Dict, Optional
-from ml.dense_search import dense_search
-from ml.keyword_search import search_keywords
+from ml.dense_search import dense_search, dense_search_batch, embed_query
+from ml.keyword_search import search_keywords, search_keywords_bm25, search_keywords_batch, search_keywords_bm25_batch
+from ml.search_tuning import search_tuner
+from ml.doc_routing import routing_monitor, ROUTE_TOP_N
+from db import route_documents
 
-def hybrid_search(query: str, user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[Dict]:
-    dense_results = dense_search(query, user_id, top_k=top_k * 2, document_ids=document_ids)
-    keyword_results = search_keywords(query, user_id, top_k=top_k * 2, document_ids=document_ids)
-    
+# Keyword engine used for the sparse leg: "ts_rank" (PostgreSQL full-text search) or "bm25" (in-memory inverted index)
+KEYWORD_ENGINE = os.getenv("KEYWORD_ENGINE", "ts_rank")
+
+KEYWORD_ENGINES = {
+    "ts_rank": search_keywords,
+    "bm25": search_keywords_bm25,
+}
+
+KEYWORD_BATCH_ENGINES = {
+    "ts_rank": search_keywords_batch,
+    "bm25": search_keywords_bm25_batch,
+}
+
+def _resolve_engine(keyword_engine: Optional[str]) -> str:
+    engine = keyword_engine or KEYWORD_ENGINE
+    if engine not in KEYWORD_ENGINES:
+        raise ValueError(f"Unknown keyword engine: {engine}. Expected one of {list(KEYWORD_ENGINES)}.")
+    return engine
+
+def hybrid_search(query: str, user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None, keyword_engine: Optional[str] = None, latency_budget_ms: Optional[float] = None, route_top_n: Optional[int] = None, query_vector: Optional[List[float]] = None) -> List[Dict]:
+    engine = _resolve_engine(keyword_engine)
+
+    # query_vector: an already computed embedding of `query` (the routing recall probe reuses the routed search's)
+    # Two-stage mode: pick the closest documents by centroid, then search as if they had been passed in document_ids
+    route_top_n = ROUTE_TOP_N if route_top_n is None else route_top_n
+    routed_ids = None
+    if route_top_n:
+        if query_vector is None:
+            query_vector = embed_query(query)
+        if query_vector is not None:
+            routed_ids = route_documents(user_id, query_vector, route_top_n, document_ids) or None
+
+    # With a latency budget, ef_search and the candidate pool come from the adaptive tuner
+    ef_search = None
+    candidate_k = top_k * 2
+    if latency_budget_ms:
+        plan = search_tuner.plan(top_k, latency_budget_ms)
+        ef_search, candidate_k = plan.ef_search, plan.candidate_k
+
+    search_ids = routed_ids or document_ids
+    dense_results = dense_search(query, user_id, top_k=candidate_k, document_ids=search_ids, ef_search=ef_search, query_vector=query_vector)
+    keyword_results = KEYWORD_ENGINES[engine](query, user_id, top_k=candidate_k, document_ids=search_ids)
+    results = rrf_fuse(dense_results, keyword_results, top_k)
+
+    if routed_ids:
+        routing_monitor.maybe_sample(
+            results,
+            lambda: hybrid_search(query, user_id, top_k, document_ids, keyword_engine, route_top_n=0, query_vector=query_vector)
+        )
+
+    return results
+
+def hybrid_search_batch(queries: List[str], user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None, keyword_engine: Optional[str] = None) -> List[List[Dict]]:
+    # Same as hybrid_search for many queries: one embedding request and one SQL statement per leg.
+    engine = _resolve_engine(keyword_engine)
+
+    dense_lists = dense_search_batch(queries, user_id, top_k=top_k * 2, document_ids=document_ids)
+    keyword_lists = KEYWORD_BATCH_ENGINES[engine](queries, user_id, top_k=top_k * 2, document_ids=document_ids)
+
+    return [rrf_fuse(dense, keyword, top_k) for dense, keyword in zip(dense_lists, keyword_lists)]
+
+def rrf_fuse(dense_results: List[Dict], keyword_results: List[Dict], top_k: int) -> List[Dict]:
     # RRF Algorithm (Reciprocal Rank Fusion)
     k = 60
     chunk_scores = {}  # Map: chunk_id -> final_score
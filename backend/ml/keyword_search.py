@@ -1,9 +1,46 @@
-# This is sparse search, which is a keyword-based search. It uses PostgreSQL's full-text search capabilities.
+# This is sparse search, which is a keyword-based search. It uses PostgreSQL's full-text search capabilities,
+# or the in-memory BM25 inverted index when the "bm25" engine is selected.
 
 from typing import List, Dict, Optional
-from db import search_keyword_chunks 
+from db import search_keyword_chunks, search_keyword_chunks_batch, get_user_chunks_for_indexing, get_chunks_by_ids, get_index_generation
+from ml.bm25_index import bm25_index
+
+def to_search_terms(query: str) -> str:
+    return " & ".join(query.strip().split())
 
 def search_keywords(query: str, user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[Dict]:
-    search_terms = " & ".join(query.strip().split())
+    search_terms = to_search_terms(query)
     # Search the database using the keyword search
-    return search_keyword_chunks(user_id, search_terms, top_k, document_ids=document_ids)
\ No newline at end of file
+    return search_keyword_chunks(user_id, search_terms, top_k, document_ids=document_ids)
+
+def search_keywords_bm25(query: str, user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[Dict]:
+    # Ranks chunks with BM25 (OR semantics), then reads content only for the winning chunk ids.
+    return search_keywords_bm25_batch([query], user_id, top_k, document_ids)[0]
+
+def search_keywords_batch(queries: List[str], user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[List[Dict]]:
+    return search_keyword_chunks_batch(user_id, [q.strip() for q in queries], top_k, document_ids=document_ids)
+
+def search_keywords_bm25_batch(queries: List[str], user_id: str, top_k: int = 5, document_ids: Optional[List[str]] = None) -> List[List[Dict]]:
+    # Ranks every query in memory, then fetches the content of all winning chunks in one round trip.
+    # One cheap lookup per search tells us whether another process changed this user's chunks
+    bm25_index.ensure_loaded(user_id, get_index_generation(user_id), get_user_chunks_for_indexing)
+    ranked_lists = [bm25_index.search(user_id, query, top_k, document_ids) for query in queries]
+
+    all_ids = list({chunk_id for ranked in ranked_lists for chunk_id, _ in ranked})
+    rows = get_chunks_by_ids(user_id, all_ids)
+
+    batch_results = []
+    for ranked in ranked_lists:
+        results = []
+        for chunk_id, score in ranked:
+            row = rows.get(chunk_id)
+            if row is None:
+                continue  # Deleted between ranking and fetching
+            results.append({
+                "content": row["content"],
+                "filename": row["filename"],
+                "score": float(score),
+                "chunk_id": chunk_id
+            })
+        batch_results.append(results)
+    return batch_results
@@ -1,6 +1,5 @@
 import os
 import re
-from pypdf import PdfReader 
 
 def clean_extracted_text(raw_text: str) -> str:
     if not raw_text:
@@ -30,6 +29,9 @@ def clean_extracted_text(raw_text: str) -> str:
 
 def parse_pdf(file_path: str) -> str:
     # Extracts text from a PDF file using pypdf.
+    # Imported here so processes that never ingest a PDF don't pay for loading pypdf at startup.
+    from pypdf import PdfReader
+
     try:
         reader = PdfReader(file_path) 
         raw_text = ""
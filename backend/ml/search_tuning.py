@@ -0,0 +1,141 @@
+# Adaptive sizing for the dense leg of hybrid search.
+# Given a per-request latency budget, picks hnsw.ef_search and the per-leg candidate count from:
+#   - observed dense search latency (EWMA of milliseconds per unit of ef_search),
+#   - observed recall per ef_search value, measured by occasionally re-running a query as an exact scan,
+#   - current load (every dense search in flight, budgeted or not, including recall probes),
+#     which shrinks the effective budget so we back off automatically.
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Set
+
+TARGET_RECALL = float(os.getenv("TARGET_RECALL", "0.95"))
+RECALL_SAMPLE_RATE = float(os.getenv("RECALL_SAMPLE_RATE", "0.02"))  # Fraction of tuned searches checked against exact search
+DENSE_BUDGET_SHARE = float(os.getenv("DENSE_BUDGET_SHARE", "0.5"))   # Part of the budget the dense leg may spend
+LOAD_THRESHOLD = int(os.getenv("SEARCH_LOAD_THRESHOLD", "8"))        # In-flight dense searches before backing off
+
+MAX_RECALL_PROBES = int(os.getenv("MAX_RECALL_PROBES", "2"))          # Exact-scan probes running at once (one per ef_search at most)
+
+MIN_RECALL_SAMPLES = 3                       # Every ef_search value is checked this many times before sampling kicks in
+EF_MULTIPLIERS = [2, 4, 6, 10, 16, 24, 40]  # ef_search ladder, as multiples of top_k
+MAX_EF_SEARCH = 1000
+EWMA_ALPHA = 0.2
+
+
+@dataclass
+class SearchPlan:
+    ef_search: int
+    candidate_k: int  # Candidates fetched per leg before RRF
+
+
+class SearchTuner:
+    def __init__(self):
+        self.ms_per_ef = 0.05              # Prior until we have observations
+        self.recall: Dict[int, float] = {}  # ef_search -> EWMA recall@k against exact search
+        self.recall_samples: Dict[int, int] = {}
+        self.probing: Set[int] = set()      # ef_search values with an exact-scan probe running
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def plan(self, top_k: int, latency_budget_ms: float) -> SearchPlan:
+        with self._lock:
+            in_flight = self.in_flight
+            ms_per_ef = self.ms_per_ef
+            recall = dict(self.recall)
+
+        # Under load every search gets slower, so spend proportionally less of the budget
+        load_factor = max(1.0, in_flight / LOAD_THRESHOLD)
+        dense_budget = latency_budget_ms * DENSE_BUDGET_SHARE / load_factor
+
+        # More candidates per leg when there is headroom, fewer when overloaded
+        if load_factor > 2:
+            candidate_k = top_k
+        elif dense_budget >= 2 * ms_per_ef * top_k * EF_MULTIPLIERS[-1]:
+            candidate_k = top_k * 3
+        else:
+            candidate_k = top_k * 2
+
+        ladder = sorted({min(MAX_EF_SEARCH, max(candidate_k, top_k * m)) for m in EF_MULTIPLIERS})
+        affordable = [ef for ef in ladder if ef * ms_per_ef <= dense_budget] or ladder[:1]
+
+        # Cheapest affordable ef that is known to hit the recall target, otherwise the most we can afford
+        for i, ef in enumerate(affordable):
+            if recall.get(ef, 0.0) >= TARGET_RECALL:
+                # Now and then probe one step cheaper, so recall gets measured there too
+                if i > 0 and random.random() < RECALL_SAMPLE_RATE:
+                    ef = affordable[i - 1]
+                return SearchPlan(ef_search=ef, candidate_k=candidate_k)
+        return SearchPlan(ef_search=affordable[-1], candidate_k=candidate_k)
+
+    @contextmanager
+    def tracking(self):
+        # Counts a dense search (of any kind) towards the load that plan() backs off from.
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def record_latency(self, ef_search: int, elapsed_ms: float):
+        with self._lock:
+            observed = elapsed_ms / max(ef_search, 1)
+            self.ms_per_ef = (1 - EWMA_ALPHA) * self.ms_per_ef + EWMA_ALPHA * observed
+
+    def record_recall(self, ef_search: int, value: float):
+        with self._lock:
+            previous = self.recall.get(ef_search)
+            self.recall[ef_search] = value if previous is None else (1 - EWMA_ALPHA) * previous + EWMA_ALPHA * value
+            self.recall_samples[ef_search] = self.recall_samples.get(ef_search, 0) + 1
+
+    def maybe_sample(self, ef_search: int, approximate: List[dict], exact_search: Callable[[], List[dict]]):
+        # Occasionally compares an approximate result against an exact scan, off the request path.
+        # At most one probe per ef_search value and MAX_RECALL_PROBES overall run at once, so a burst of
+        # requests while an ef_search value is still being learned doesn't start a burst of sequential scans.
+        if not approximate:
+            return
+        with self._lock:
+            if self.in_flight > LOAD_THRESHOLD or ef_search in self.probing or len(self.probing) >= MAX_RECALL_PROBES:
+                return
+            learning = self.recall_samples.get(ef_search, 0) < MIN_RECALL_SAMPLES
+            if not learning and random.random() >= RECALL_SAMPLE_RATE:
+                return
+            self.probing.add(ef_search)
+
+        def run():
+            try:
+                with self.tracking():
+                    exact = exact_search()
+            except Exception as e:
+                print(f"Recall sampling failed: {e}")
+                return
+            finally:
+                with self._lock:
+                    self.probing.discard(ef_search)
+            if exact:
+                found = {doc['content'] for doc in approximate}
+                hits = sum(1 for doc in exact if doc['content'] in found)
+                self.record_recall(ef_search, hits / len(exact))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"ms_per_ef": self.ms_per_ef, "recall": dict(self.recall), "in_flight": self.in_flight, "probing": sorted(self.probing)}
+
+
+search_tuner = SearchTuner()
+
+
+def timed(fn: Callable, ef_search: int):
+    # Runs one dense search, counting it as load and feeding its latency back into the tuner.
+    with search_tuner.tracking():
+        start = time.perf_counter()
+        result = fn()
+    search_tuner.record_latency(ef_search, (time.perf_counter() - start) * 1000)
+    return result
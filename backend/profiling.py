@@ -0,0 +1,156 @@
+# Opt-in per-request profiling for the query and ingest endpoints.
+# A request is profiled when it carries `X-Profile: 1` (or `?profile=1`) together with a valid
+# `X-Profile-Token`, or when it is picked by PROFILE_SAMPLE_RATE for continuous low-overhead profiling.
+# Profiles are written to PROFILE_DIR and the response gets an `X-Profile-Id` header; fetch them from
+# GET /api/profiles/{profile_id}. When neither a token nor a sample rate is configured the middleware
+# isn't installed at all, so there is no per-request cost.
+#
+# Uses pyinstrument (sampling, async-aware, HTML output) when installed, otherwise the stdlib's cProfile
+# (deterministic, .prof output for snakeviz / pstats). cProfile sees everything on the event loop thread
+# while the request runs, so concurrent requests can show up in its output. Because of that overhead,
+# PROFILE_SAMPLE_RATE only takes effect with pyinstrument; explicitly requested profiles work with either.
+# Only the newest PROFILE_MAX_FILES profiles younger than PROFILE_MAX_AGE_HOURS are kept.
+
+import asyncio
+import hmac
+import importlib.util
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Optional
+from urllib.parse import parse_qs
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_MAX_AGE_HOURS = float(os.getenv("PROFILE_MAX_AGE_HOURS", "72"))
+PROFILED_PATHS = {"/api/query", "/api/query/stream", "/api/ingest"}
+
+HAS_PYINSTRUMENT = importlib.util.find_spec("pyinstrument") is not None
+if PROFILE_SAMPLE_RATE > 0 and not HAS_PYINSTRUMENT:
+    print("WARNING: PROFILE_SAMPLE_RATE is set but pyinstrument is not installed; sampled profiling is disabled.")
+    PROFILE_SAMPLE_RATE = 0.0
+
+PROFILING_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+# Python allows one active profiler per thread, and all requests share the event loop thread
+_active = threading.Lock()
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def find_profile(profile_id: str) -> Optional[str]:
+    # Returns the stored file for a profile id, if any.
+    if not all(ch in "0123456789abcdef" for ch in profile_id):
+        return None
+    for ext in ("html", "prof"):
+        path = os.path.join(PROFILE_DIR, f"{profile_id}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def prune_profiles():
+    # Deletes profiles past the age limit, then the oldest ones beyond PROFILE_MAX_FILES.
+    try:
+        entries = [os.path.join(PROFILE_DIR, name) for name in os.listdir(PROFILE_DIR) if name.endswith((".html", ".prof"))]
+    except FileNotFoundError:
+        return
+
+    entries.sort(key=os.path.getmtime, reverse=True)
+    cutoff = time.time() - PROFILE_MAX_AGE_HOURS * 3600
+    for i, path in enumerate(entries):
+        if i >= PROFILE_MAX_FILES or os.path.getmtime(path) < cutoff:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class _Profile:
+    def __init__(self):
+        if HAS_PYINSTRUMENT:
+            from pyinstrument import Profiler
+            self.profiler = Profiler(async_mode="enabled")
+            self.kind = "pyinstrument"
+        else:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.kind = "cprofile"
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.kind == "pyinstrument":
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+
+    def save(self, profile_id: str):
+        # Renders and writes the report; slow for big profiles, so callers run it off the event loop
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if self.kind == "pyinstrument":
+            with open(os.path.join(PROFILE_DIR, f"{profile_id}.html"), "w", encoding="utf-8") as f:
+                f.write(self.profiler.output_html())
+        else:
+            self.profiler.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+
+
+class ProfilingMiddleware:
+    # Plain ASGI middleware (not BaseHTTPMiddleware) so streaming bodies are profiled to the end.
+
+    def __init__(self, app):
+        self.app = app
+
+    def _wants_profile(self, scope) -> bool:
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        flag = headers.get("x-profile") == "1" or parse_qs(scope.get("query_string", b"").decode()).get("profile") == ["1"]
+        if flag and is_authorized(headers.get("x-profile-token")):
+            return True
+        return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in PROFILED_PATHS or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        # Another request is already being profiled; serve this one normally
+        if not _active.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = f"{int(time.time())}{uuid.uuid4().hex[:12]}"
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        profile = _Profile()
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            # Stop on the loop (profilers are tied to it), then render, write and prune in a worker thread
+            try:
+                profile.stop()
+            finally:
+                _active.release()
+            try:
+                await asyncio.to_thread(self._save, profile, profile_id)
+            except Exception as e:
+                print(f"Saving profile {profile_id} failed: {e}")
+
+    @staticmethod
+    def _save(profile: _Profile, profile_id: str):
+        profile.save(profile_id)
+        prune_profiles()
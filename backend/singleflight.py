@@ -0,0 +1,179 @@
+# Request coalescing for /api/query/stream.
+# Concurrent identical requests (same user, query, document filter, top_k, ...) share one retrieval and one
+# LLM stream: the first request starts a SharedStream, later ones subscribe to it and replay every event
+# from the beginning, so the Groq call happens once no matter how many users asked at the same moment.
+# CallFlights does the same for one-shot calls made alongside a stream, such as generating the chat title.
+
+import asyncio
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable
+
+from admission import admission
+
+STREAM_MAX_LAG_FRAMES = int(os.getenv("STREAM_MAX_LAG_FRAMES", "32"))                  # Frames a subscriber may fall behind before the flight pauses
+STREAM_LAGGARD_TIMEOUT_SECONDS = float(os.getenv("STREAM_LAGGARD_TIMEOUT_SECONDS", "10"))  # Pause length after which lagging subscribers are dropped
+
+
+class SharedStream:
+    # Runs one async event source and fans its events out to any number of subscribers.
+    # The source is paced to the slowest subscriber: once anyone is STREAM_MAX_LAG_FRAMES behind it stops
+    # pulling events (which in turn pauses the LLM read through coalesce_tokens' backpressure). A subscriber
+    # that stays behind for STREAM_LAGGARD_TIMEOUT_SECONDS is dropped so one stalled client can't hold the rest.
+
+    def __init__(self, source: AsyncIterator, on_finish: Callable[[], None]):
+        self.events = []
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self.subscribers = 0
+        self._positions: Dict[object, int] = {}  # Next event index per reading subscriber
+        self._dropped = set()
+        self._changed = asyncio.Event()
+        self._progressed = asyncio.Event()
+        self._task = asyncio.create_task(self._run(source))
+        # A done callback runs even when the task is cancelled before its first step, unlike a finally in _run
+        self._task.add_done_callback(lambda task: self._finish(task, on_finish))
+
+    def _notify(self):
+        # Wake everyone waiting on the current event, and give later waiters a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _notify_progress(self):
+        self._progressed.set()
+        self._progressed = asyncio.Event()
+
+    async def _run(self, source: AsyncIterator):
+        try:
+            async for event in source:
+                self.events.append(event)
+                self._notify()
+                await self._wait_for_readers()
+        except Exception as e:
+            self.error = e
+
+    async def _wait_for_readers(self):
+        loop = asyncio.get_running_loop()
+        deadline = None
+        while True:
+            floor = len(self.events) - STREAM_MAX_LAG_FRAMES
+            laggards = [sid for sid, index in self._positions.items() if index < floor]
+            if not laggards:
+                return
+            if deadline is None:
+                deadline = loop.time() + STREAM_LAGGARD_TIMEOUT_SECONDS
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                for sid in laggards:
+                    del self._positions[sid]
+                    self._dropped.add(sid)
+                return
+            try:
+                await asyncio.wait_for(self._progressed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    def _finish(self, task: asyncio.Task, on_finish: Callable[[], None]):
+        if task.cancelled() and self.error is None:
+            self.error = RuntimeError("Stream cancelled.")
+        self.done = True
+        self._positions.clear()
+        self._notify()
+        on_finish()
+
+    def is_joinable(self) -> bool:
+        return not self.done and not self.cancelled
+
+    async def subscribe(self) -> AsyncIterator:
+        # Yields every event from the start. The subscriber must have been counted by StreamFlights.join_or_start.
+        sid = object()
+        index = 0
+        if not self.done:
+            self._positions[sid] = 0
+        try:
+            while True:
+                while index < len(self.events):
+                    if sid in self._dropped:
+                        raise RuntimeError("Client fell too far behind the stream.")
+                    yield self.events[index]
+                    index += 1
+                    if sid in self._positions:
+                        self._positions[sid] = index
+                        self._notify_progress()
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self._positions.pop(sid, None)
+            self._dropped.discard(sid)
+            self._notify_progress()
+            self.leave()
+
+    def leave(self):
+        # Drops one subscriber counted by StreamFlights.join_or_start. Also used when a request that joined
+        # fails before it starts reading, so the flight never outlives its last real listener.
+        self.subscribers -= 1
+        # Nobody is listening any more: stop the retrieval / LLM work
+        if self.subscribers == 0 and not self.done:
+            self.cancelled = True
+            self._task.cancel()
+
+
+class StreamFlights:
+    def __init__(self):
+        self.flights: Dict[Hashable, SharedStream] = {}
+
+    async def join_or_start(self, key: Hashable, source_factory: Callable[[], AsyncIterator]) -> SharedStream:
+        # Joins an in-flight identical request, or passes admission control and starts a new one.
+        flight = self.flights.get(key)
+        if flight is None or not flight.is_joinable():
+            await admission.acquire()  # Raises Overloaded
+
+            # Someone may have started the same request while we waited for a slot
+            flight = self.flights.get(key)
+            if flight is not None and flight.is_joinable():
+                admission.release()
+            else:
+                flight = self._start(key, source_factory)
+
+        flight.subscribers += 1
+        return flight
+
+    def _start(self, key: Hashable, source_factory: Callable[[], AsyncIterator]) -> SharedStream:
+        def finish():
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            admission.release()
+
+        flight = SharedStream(source_factory(), finish)
+        self.flights[key] = flight
+        return flight
+
+
+class CallFlights:
+    # Coalesces identical concurrent one-shot async calls: the first caller starts the call, later callers
+    # with the same key await the same result (or exception).
+
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # One caller going away must not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every caller has gone
+
+
+stream_flights = StreamFlights()
+title_flights = CallFlights()
@@ -0,0 +1,98 @@
+# Token transport for the SSE chat stream.
+# The blocking LLM iterator runs in a worker thread and hands tokens to the event loop through a bounded buffer,
+# which are then coalesced into frames by time window or size instead of one SSE frame per token.
+#   - Backpressure: when the client reads slowly the buffer fills up and the worker stops pulling from the LLM.
+#   - Disconnects: when the response is cancelled the worker stops and closes the upstream stream.
+
+import asyncio
+import os
+import threading
+from typing import AsyncIterator, Iterator
+
+STREAM_MODE = os.getenv("STREAM_MODE", "coalesced")                   # "coalesced" or "token" (one frame per token)
+STREAM_FLUSH_MS = int(os.getenv("STREAM_FLUSH_MS", "50"))            # Max time a token waits before being sent
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "512"))     # Send as soon as a frame holds this much text
+STREAM_BUFFER_CHARS = int(os.getenv("STREAM_BUFFER_CHARS", "8192")) # Unsent text buffered before the producer blocks
+
+
+async def coalesce_tokens(
+    tokens: Iterator[str],
+    flush_ms: int = STREAM_FLUSH_MS,
+    flush_chars: int = STREAM_FLUSH_CHARS,
+    buffer_chars: int = STREAM_BUFFER_CHARS
+) -> AsyncIterator[str]:
+    # Yields groups of tokens from a blocking iterator, each group ready to become one SSE frame.
+    # The worker only appends to a list under a lock; it wakes the event loop at most twice per frame
+    # (first token of a frame, and when the frame fills up) rather than once per token.
+    loop = asyncio.get_running_loop()
+    cond = threading.Condition()
+    pending = []
+    state = {"chars": 0, "done": False, "error": None}
+    has_data = asyncio.Event()
+    frame_full = asyncio.Event()
+    stop = threading.Event()
+
+    def wake(event: asyncio.Event):
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            pass  # Event loop already closed
+
+    def produce():
+        try:
+            for token in tokens:
+                with cond:
+                    # Backpressure: the client isn't keeping up, so stop reading from the LLM for now
+                    while state["chars"] >= buffer_chars and not stop.is_set():
+                        cond.wait(0.1)
+                    if stop.is_set():
+                        break
+                    was_empty = not pending
+                    pending.append(token)
+                    state["chars"] += len(token)
+                    filled = state["chars"] >= flush_chars > state["chars"] - len(token)
+                if was_empty:
+                    wake(has_data)
+                if filled:
+                    wake(frame_full)
+        except Exception as e:
+            state["error"] = e
+        finally:
+            close = getattr(tokens, "close", None)
+            if close is not None:
+                close()
+            with cond:
+                state["done"] = True
+            wake(has_data)
+            wake(frame_full)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    try:
+        while True:
+            await has_data.wait()
+            if not state["done"]:
+                # Give the frame up to flush_ms to collect more tokens, unless it fills up first
+                try:
+                    await asyncio.wait_for(frame_full.wait(), flush_ms / 1000)
+                except asyncio.TimeoutError:
+                    pass
+
+            with cond:
+                parts = pending[:]
+                pending.clear()
+                state["chars"] = 0
+                done = state["done"]
+                has_data.clear()
+                frame_full.clear()
+                cond.notify()
+
+            if parts:
+                yield "".join(parts)
+            if done:
+                if state["error"] is not None:
+                    raise state["error"]
+                return
+    finally:
+        # Covers normal completion, errors and client disconnects (the response task is cancelled)
+        stop.set()
@@ -0,0 +1,59 @@
+# Startup warm-up so the first real request doesn't pay for cold subsystems.
+# Runs in the background after the app starts: opens the DB pool, makes Ollama load the embedding model
+# and constructs the shared Groq client. Progress is reported by GET /ready.
+# measure_startup.py compares import time and first-request latency with and without it.
+
+import asyncio
+import os
+import time
+from typing import Callable, Dict
+
+from db import warm_pool
+from ml.embedder import generate_embeddings
+from groq_client import get_groq_client
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+WARMUP_INITIAL_BACKOFF_SECONDS = float(os.getenv("WARMUP_INITIAL_BACKOFF_SECONDS", "1"))
+WARMUP_MAX_BACKOFF_SECONDS = float(os.getenv("WARMUP_MAX_BACKOFF_SECONDS", "30"))
+
+
+class Warmup:
+    def __init__(self):
+        self.subsystems: Dict[str, Callable[[], None]] = {
+            "database": warm_pool,
+            "embedder": lambda: generate_embeddings(["warmup"]),
+            "llm": get_groq_client,
+        }
+        self.state: Dict[str, dict] = {name: {"status": "pending"} for name in self.subsystems}
+        self.started = time.monotonic()
+
+    async def _warm(self, name: str):
+        # Keeps retrying with exponential backoff, so a dependency that is still starting (or a transient
+        # error) only delays readiness instead of leaving /ready at 503 for the life of the process.
+        attempts = 0
+        delay = WARMUP_INITIAL_BACKOFF_SECONDS
+        while True:
+            attempts += 1
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.subsystems[name])
+                self.state[name] = {"status": "warm", "elapsed_ms": round((time.perf_counter() - start) * 1000, 1), "attempts": attempts}
+                return
+            except Exception as e:
+                self.state[name] = {"status": "retrying", "error": str(e), "attempts": attempts, "retry_in_s": delay}
+                print(f"Warm-up of {name} failed (attempt {attempts}), retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_MAX_BACKOFF_SECONDS)
+
+    async def run(self):
+        await asyncio.gather(*(self._warm(name) for name in self.subsystems))
+
+    def status(self) -> dict:
+        return {
+            "ready": all(s["status"] == "warm" for s in self.state.values()),
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "subsystems": self.state
+        }
+
+
+warmup = Warmup()
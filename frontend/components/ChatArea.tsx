@@ -121,13 +121,16 @@ export default function ChatArea({
 
       const reader = res.body.getReader();
       const decoder = new TextDecoder();
+      let buffered = "";
 
       while (true) {
         const { done, value } = await reader.read();
         if (done) break;
 
-        const chunk = decoder.decode(value);
-        const lines = chunk.split("\n");
+        // Coalesced frames can span reads, so keep the trailing partial line for next time
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split("\n");
+        buffered = lines.pop() ?? "";
 
         for (const line of lines) {
           if (line.startsWith("data: ")) {